@@ -1,66 +1,102 @@
-from flask import Flask, request
+from flask import Flask, Request as BaseRequest, current_app, g, request
 from flask_migrate import Migrate
 from flask_restful import Api
-from flask_uploads import configure_uploads, patch_request_class
+from flask_uploads import configure_uploads
 
 from config import Config
-from extensions import db, jwt, image_set, cache, limiter
+from extensions import (
+    db, jwt, image_set, cache, limiter, mail_queue, image_pool, revoked_tokens,
+    password_hasher, metrics)
 from models.user import User
-from resources.recipe import RecipeListResource, RecipeResource
+from models.recipe import Recipe
+from models.recipe_search import RecipeSearchTerm
+from resources.recipe import (
+    RecipeListResource, RecipeResource, RecipeBulkResource)
 from resources.recipe import RecipePublishResource, RecipeCoverUploadResource
 from resources.user import (
     UserListResource, UserResource, MeResource, UserRecipeListResource,
     UserActivateResource, UserAvatarUploadResource)
 from resources.token import (
-    TokenResource, RefreshResource, RevokeResource, blacklist)
+    TokenResource, RefreshResource, RevokeResource)
+from resources.metrics import MetricsResource
+from resources.image import ImageResource
+from ratelimit import configure_rate_limits
+from routing import configure_database
 
-def create_app():
+class Request(BaseRequest):
+    """
+    This class lets a resource accept larger bodies than MAX_CONTENT_LENGTH,
+    which is meant for the image uploads, by defining a max_content_length
+    static method that returns its own limit.
+    """
+    @property
+    def max_content_length(self):
+        view = current_app.view_functions.get(self.endpoint)
+        resource = getattr(view, 'view_class', None)
+        if hasattr(resource, 'max_content_length'):
+            return resource.max_content_length()
+
+        return super().max_content_length
+
+def create_app(config_object=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.request_class = Request
+    app.config.from_object(config_object)
     
     register_extensions(app)
     register_resources(app)
+    register_commands(app)
     
     return app
 
 @limiter.request_filter
 def ip_whitelist():
-    return request.remote_addr == '127.0.0.1'
+    return request.remote_addr in current_app.config.get(
+        'RATELIMIT_WHITELIST', ['127.0.0.1'])
     
 
 def register_extensions(app):
+    configure_database(app)
     db.init_app(app)
     migrate = Migrate(app, db)
     jwt.init_app(app)
-    patch_request_class(app, 10*1024*1024)
+    # the limit of the image uploads (10 MB unless set), it is set in the
+    # config rather than with patch_request_class whose class attribute
+    # would hide the limits of Request
+    if app.config.get('MAX_CONTENT_LENGTH') is None:
+        app.config['MAX_CONTENT_LENGTH'] = 10*1024*1024
     configure_uploads(app, image_set)
     cache.init_app(app)
+    configure_rate_limits(app)
     limiter.init_app(app)
+    mail_queue.init_app(app)
+    image_pool.init_app(app)
+    revoked_tokens.init_app(app, cache)
+    password_hasher.init_app(app)
+    metrics.init_app(app)
     
     @jwt.token_in_blocklist_loader
     def check_if_token_revoked(jwt_header, jwt_payload: dict) -> bool:
         jti = jwt_payload["jti"]
+        # the limiter and the view check the token of the same request
+        checked = g.setdefault('revoked_tokens', {})
+        if jti not in checked:
+            checked[jti] = revoked_tokens.is_revoked(jti,
+                                                     jwt_payload.get("exp"))
 
-        return jti in blacklist
-    
-    @app.before_request
-    def before_request():
-        print("\n===============Before request============")
-        print(cache.cache._cache.keys())
-        print("\n=========================================")
+        return checked[jti]
     
-    @app.after_request
-    def after_request(response):
-        print("\n===============After request============")
-        print(cache.cache._cache.keys())
-        print("=========================================")
-        
-        return response
+    @app.teardown_request
+    def forget_token_checks(exception=None):
+        # g outlives the request when an app context was already pushed
+        for name in ('jwt_identity', 'jwt_verified', 'revoked_tokens'):
+            g.pop(name, None)
     
 def register_resources(app):
     api = Api(app)
     
     api.add_resource(RecipeListResource, "/recipes")
+    api.add_resource(RecipeBulkResource, "/recipes/bulk")
     api.add_resource(RecipeResource, "/recipes/<int:recipe_id>")
     api.add_resource(RecipePublishResource, "/recipes/<int:recipe_id>/publish")
     api.add_resource(UserListResource, "/users")
@@ -73,6 +109,18 @@ def register_resources(app):
     api.add_resource(UserActivateResource, '/users/activate/<string:token>')
     api.add_resource(UserAvatarUploadResource, '/users/avatar')
     api.add_resource(RecipeCoverUploadResource, '/recipes/<int:recipe_id>/cover')
+    api.add_resource(MetricsResource, '/metrics')
+    api.add_resource(ImageResource,
+                     '/images/<string:folder>/<string:filename>')
+
+def register_commands(app):
+    
+    @app.cli.command('reindex-recipes')
+    def reindex_recipes():
+        """Rebuild the search index of every recipe."""
+        for recipe in Recipe.query.yield_per(500):
+            RecipeSearchTerm.index_recipe(recipe)
+        db.session.commit()
 
 
 if __name__=='__main__':
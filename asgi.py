@@ -0,0 +1,15 @@
+"""
+This module serves the app to ASGI servers:
+
+    uvicorn asgi:app --workers 4
+
+The app itself is synchronous (Flask-RESTful does not await async views),
+so each request runs in the thread pool of the adapter. The slow work is
+already done outside of the requests: the emails in the mail queue, the
+images and the password hashes in process pools.
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from wsgi import app as wsgi_app
+
+app = WsgiToAsgi(wsgi_app)
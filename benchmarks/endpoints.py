@@ -0,0 +1,245 @@
+"""
+This script seeds a database with users and recipes and measures the
+throughput and the latency of the main flows of the app, run through
+create_app with the test client:
+
+    python benchmarks/endpoints.py --database-url sqlite:///endpoints.db \
+        --output baseline.json
+    python benchmarks/endpoints.py --compare baseline.json
+
+The results are saved as JSON, keyed by flow, and comparing them with a
+previous run exits with an error when a flow got slower than --threshold.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from PIL import Image
+
+from app import create_app
+from config import Config
+from extensions import db
+from models.user import User
+from models.recipe import Recipe
+from models.recipe_search import RecipeSearchTerm
+from recipe_indexes import WORDS, seed
+from utils import hash_password
+
+USERNAME = 'benchmark'
+EMAIL = 'benchmark@example.com'
+PASSWORD = 'benchmark-password'
+
+
+def make_config(args):
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url
+        UPLOADED_IMAGES_DEST = tempfile.mkdtemp(prefix='smilecook-')
+        CACHE_TYPE = 'SimpleCache' if args.cache else 'NullCache'
+        RATELIMIT_ENABLED = False
+        DEBUG = False
+        TESTING = False
+
+    return BenchmarkConfig
+
+
+def prepare(num_users, num_recipes):
+    """This function seeds the database once and returns the benchmark user"""
+    db.create_all()
+
+    if not db.session.query(Recipe.query.exists()).scalar():
+        seed(num_users, num_recipes)
+        ids = [id for id, in db.session.query(Recipe.id)]
+        for offset in range(0, len(ids), 1000):
+            RecipeSearchTerm.index_new_recipes(Recipe.query.filter(
+                Recipe.id.in_(ids[offset:offset + 1000])))
+            db.session.commit()
+
+    user = User.get_by_username(USERNAME)
+    if user is None:
+        user = User(username=USERNAME, email=EMAIL, is_active=True,
+                    password=hash_password(PASSWORD))
+        user.save()
+        for i in range(10):
+            Recipe(name='Benchmark {}'.format(i), description='A dish',
+                   directions='Mix everything.', ingredients='egg, rice',
+                   cook_time=10, num_of_servings=2, is_publish=True,
+                   user_id=user.id).save()
+
+    return user.id
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (1200, 900), (200, 120, 40)).save(buffer, 'JPEG')
+
+    return buffer.getvalue()
+
+
+def make_flows(client, own_recipe_ids, headers):
+    """
+    This function returns the flows to measure, each one is a function that
+    sends a request and returns its response.
+    """
+    image = make_image()
+
+    def upload():
+        return client.put(
+            '/recipes/{}/cover'.format(random.choice(own_recipe_ids)),
+            headers=headers, content_type='multipart/form-data',
+            data={'cover': (io.BytesIO(image), 'cover.jpg')})
+
+    def publish():
+        # the recipe is published again so that it can still be read
+        recipe_id = random.choice(own_recipe_ids)
+        client.delete('/recipes/{}/publish'.format(recipe_id),
+                      headers=headers)
+        return client.put('/recipes/{}/publish'.format(recipe_id),
+                          headers=headers)
+
+    return {
+        'list': lambda: client.get('/recipes?page={}'.format(
+            random.randint(1, 100))),
+        'search': lambda: client.get('/recipes?q={}'.format(
+            random.choice(WORDS))),
+        # only its author can read a recipe
+        'detail': lambda: client.get('/recipes/{}'.format(
+            random.choice(own_recipe_ids)), headers=headers),
+        'login': lambda: client.post('/token', json={
+            'email': EMAIL, 'password': PASSWORD}),
+        'upload': upload,
+        'publish': publish,
+    }
+
+
+def percentile(durations, fraction):
+    return durations[min(int(round(fraction * (len(durations) - 1))),
+                         len(durations) - 1)]
+
+
+def measure(flow, num_requests, threads):
+    def timed(_):
+        start = time.perf_counter()
+        response = flow()
+        return time.perf_counter() - start, response.status_code < 400
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(timed, range(num_requests)))
+    duration = time.perf_counter() - start
+
+    durations = sorted(duration for duration, _ in results)
+    return {
+        'requests': num_requests,
+        'errors': sum(1 for _, ok in results if not ok),
+        'throughput': num_requests / duration,
+        'mean_ms': sum(durations) / len(durations) * 1000,
+        'p50_ms': percentile(durations, 0.5) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, options, baseline, threshold):
+    """This function prints the change of each flow and returns the slower"""
+    regressions = []
+    if baseline['options'] != options:
+        print('the baseline was run with other options: {}'.format(
+            baseline['options']))
+
+    for name, result in results.items():
+        previous = baseline['flows'].get(name)
+        if previous is None:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            change = (result[key] - previous[key]) / previous[key]
+            print('{:8} {:7} {:8.2f}ms -> {:8.2f}ms ({:+.0%})'.format(
+                name, key, previous[key], result[key], change))
+            if change > threshold:
+                regressions.append('{} {}'.format(name, key))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', default='sqlite:///endpoints.db')
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--flows', nargs='*')
+    parser.add_argument('--no-cache', dest='cache', action='store_false')
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(0)
+    app = create_app(make_config(args))
+    with app.app_context():
+        user_id = prepare(args.users, args.recipes)
+        own_recipe_ids = [id for id, in db.session.query(Recipe.id)
+                          .filter_by(user_id=user_id)]
+        database = db.engine.url.get_backend_name()
+
+    client = app.test_client()
+    token = client.post('/token', json={
+        'email': EMAIL, 'password': PASSWORD}).get_json()['access_token']
+    headers = {'Authorization': 'Bearer {}'.format(token)}
+    flows = make_flows(client, own_recipe_ids, headers)
+
+    results = {}
+    for name, flow in flows.items():
+        if args.flows and name not in args.flows:
+            continue
+        # a few requests first so that the caches and pools are warm
+        for _ in range(min(10, args.requests)):
+            flow()
+        results[name] = measure(flow, args.requests, args.threads)
+        print('{:8} {throughput:8.1f} req/s  p50 {p50_ms:8.2f}ms  '
+              'p99 {p99_ms:8.2f}ms  errors {errors}'.format(
+                  name, **results[name]))
+
+    report = {
+        'commit': current_commit(),
+        'date': datetime.utcnow().isoformat(),
+        'options': {'database': database,
+                    'recipes': args.recipes, 'requests': args.requests,
+                    'threads': args.threads, 'cache': args.cache},
+        'flows': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, report['options'],
+                                  json.load(baseline), args.threshold)
+        if regressions:
+            sys.exit('slower than the baseline: {}'.format(
+                ', '.join(regressions)))
+
+
+if __name__ == '__main__':
+    main()
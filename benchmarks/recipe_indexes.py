@@ -0,0 +1,143 @@
+"""
+This script seeds a database with recipes and prints the query plans of the
+recipe list queries without and with the indexes declared on Recipe, along
+with how long each query took.
+
+    python benchmarks/recipe_indexes.py --database-url postgresql://... \
+        --recipes 1000000
+
+The database should be an empty one made for the benchmark, its recipe
+tables are created (and filled) by the script.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from flask import Flask
+
+from extensions import db
+from models.user import User
+from models.recipe import Recipe
+from models.recipe_search import RecipeSearchTerm
+
+WORDS = ['egg', 'tomato', 'rice', 'chicken', 'tofu', 'garlic', 'onion',
+         'pasta', 'bean', 'curry', 'salad', 'soup', 'bread', 'cheese', 'beef',
+         'lemon', 'ginger', 'mushroom', 'pepper', 'potato']
+
+
+def create_app(database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    return app
+
+
+def seed(num_users, num_recipes, batch_size=10000):
+    db.session.execute(User.__table__.insert(), [
+        {'username': 'user{}'.format(i), 'email': 'user{}@example.com'
+         .format(i), 'is_active': True} for i in range(num_users)])
+    user_ids = [id for id, in db.session.query(User.id)]
+
+    start = datetime(2020, 1, 1)
+    for offset in range(0, num_recipes, batch_size):
+        rows = []
+        for i in range(offset, min(offset + batch_size, num_recipes)):
+            words = random.sample(WORDS, 3)
+            rows.append({
+                'name': ' '.join(words[:2]),
+                'description': 'A {} dish'.format(words[2]),
+                'ingredients': ', '.join(random.sample(WORDS, 4)),
+                'directions': 'Mix everything.',
+                'num_of_servings': random.randint(1, 10),
+                'cook_time': random.randint(5, 180),
+                'is_publish': random.random() < 0.8,
+                'user_id': random.choice(user_ids),
+                'created_at': start + timedelta(minutes=i),
+                'updated_at': start + timedelta(minutes=i)
+            })
+        db.session.execute(Recipe.__table__.insert(), rows)
+        db.session.commit()
+        print('seeded {} recipes'.format(offset + len(rows)))
+
+
+def list_queries(user_id):
+    """The queries run by the recipe lists, keyed by a short description"""
+    queries = {}
+
+    for sort in ['created_at', 'cook_time', 'num_of_servings']:
+        query, sort_column = Recipe.search('', sort)
+        queries['published by {}'.format(sort)] = query \
+            .filter(Recipe.is_publish.is_(True)) \
+            .order_by(sort_column.desc(), Recipe.id.desc()) \
+            .limit(10).offset(1000)
+
+    query, sort_column = Recipe.search('', 'created_at')
+    queries['published by user'] = query \
+        .filter_by(user_id=user_id, is_publish=True) \
+        .order_by(sort_column.desc(), Recipe.id.desc()).limit(10)
+
+    return queries
+
+
+def explain(queries):
+    dialect = db.engine.dialect
+    prefix = 'EXPLAIN QUERY PLAN' if dialect.name == 'sqlite' \
+        else 'EXPLAIN ANALYZE'
+
+    for name, query in queries.items():
+        sql = str(query.statement.compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+        start = time.perf_counter()
+        db.session.execute(db.text(sql)).fetchall()
+        duration = time.perf_counter() - start
+
+        print('\n-- {} ({:.1f}ms)'.format(name, duration * 1000))
+        for row in db.session.execute(db.text('{} {}'.format(prefix, sql))):
+            print('   ', ' '.join(str(column) for column in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database-url', default='sqlite:///benchmark.db')
+    parser.add_argument('--recipes', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app(args.database_url)
+    with app.app_context():
+        tables = [User.__table__, Recipe.__table__,
+                  RecipeSearchTerm.__table__]
+        db.metadata.create_all(db.engine, tables=tables)
+        if not db.session.query(Recipe.query.exists()).scalar():
+            seed(args.users, args.recipes)
+
+        indexes = list(Recipe.__table__.indexes)
+        for index in indexes:
+            index.drop(db.engine, checkfirst=True)
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+        queries = list_queries(db.session.query(User.id).first()[0])
+        print('\n==== without the indexes ====')
+        explain(queries)
+
+        for index in indexes:
+            index.create(db.engine)
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+        print('\n==== with the indexes ====')
+        explain(queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+This script compares how many recipes per second are dumped by the recipe
+list schema and by its compiled version, and checks that both give the same
+JSON.
+
+    python benchmarks/serializers.py --recipes 1000 --repeat 20
+
+The recipes are built in memory, no database is needed.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from flask import Flask
+from flask_restful import Api
+from flask_sqlalchemy.pagination import Pagination
+
+from models.user import User
+from models.recipe import Recipe
+from resources.image import ImageResource
+from schema.compiled import compile_schema
+from schema.recipe import RecipePaginationSchema
+
+
+class StaticPagination(Pagination):
+    """A page of recipes that are already in memory"""
+
+    def _query_items(self):
+        return self._query_args['items']
+
+    def _query_count(self):
+        return len(self._query_args['items'])
+
+
+def create_app(webp):
+    app = Flask(__name__)
+    app.config['IMAGE_WEBP'] = webp
+    # the urls of the covers are built for the image endpoint
+    Api(app).add_resource(ImageResource,
+                          '/images/<string:folder>/<string:filename>')
+
+    return app
+
+
+def make_recipes(num_recipes):
+    start = datetime(2020, 1, 1)
+    users = [User(id=i, username='user{}'.format(i),
+                  email='user{}@example.com'.format(i),
+                  avatar_image=None) for i in range(10)]
+
+    return [Recipe(id=i, name='Recipe {}'.format(i),
+                   description='A tasty dish', directions='Mix everything.',
+                   ingredients='egg, tomato, rice', num_of_servings=2,
+                   cook_time=30, is_publish=True,
+                   cover_image='{:032x}_full.jpg'.format(i) if i % 2 else None,
+                   created_at=start + timedelta(minutes=i),
+                   updated_at=start + timedelta(minutes=i),
+                   user=users[i % len(users)]) for i in range(num_recipes)]
+
+
+def measure(dump, page, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        dump(page)
+    duration = time.perf_counter() - start
+
+    return len(page.items) * repeat / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--recipes', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--webp', action='store_true')
+    args = parser.parse_args()
+
+    app = create_app(args.webp)
+    schema = RecipePaginationSchema()
+    dump = compile_schema(schema)
+    page = StaticPagination(page=1, per_page=args.recipes, max_per_page=None,
+                            items=make_recipes(args.recipes))
+
+    with app.test_request_context('/recipes?per_page={}'.format(
+            args.recipes)):
+        if json.dumps(schema.dump(page)) != json.dumps(dump(page)):
+            sys.exit('the compiled schema does not give the same output')
+
+        marshmallow_rate = measure(schema.dump, page, args.repeat)
+        compiled_rate = measure(dump, page, args.repeat)
+
+    print('marshmallow {:10.0f} items/s'.format(marshmallow_rate))
+    print('compiled    {:10.0f} items/s ({:.1f}x)'.format(
+        compiled_rate, compiled_rate / marshmallow_rate))
+
+
+if __name__ == '__main__':
+    main()
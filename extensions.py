@@ -1,12 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager
 from flask_uploads import UploadSet, IMAGES
 from flask_caching import Cache
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 
-db = SQLAlchemy()
-jwt = JWTManager()
+from hashing import PasswordHasher
+from jobs import JobQueue, ProcessPool
+from mailgun import is_transient
+from metrics import Metrics
+from ratelimit import rate_limit_key
+from revocation import RevocationStore
+from routing import RoutingSession
+from tokencache import CachingJWTManager
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 image_set = UploadSet('images', IMAGES)
 cache = Cache()
-limiter = Limiter(key_func=get_remote_address)
\ No newline at end of file
+limiter = Limiter(key_func=rate_limit_key)
+mail_queue = JobQueue('MAIL_QUEUE', retry_if=is_transient)
+image_pool = ProcessPool('IMAGE_POOL')
+revoked_tokens = RevocationStore()
+metrics = Metrics()
+jwt = CachingJWTManager(metrics)
+password_hasher = PasswordHasher(metrics)
@@ -0,0 +1,73 @@
+"""
+The gunicorn settings of the app, each one can be changed through the
+environment:
+
+    GUNICORN_BIND          the address to listen on (0.0.0.0:8000)
+    GUNICORN_WORKERS       the number of processes (2 per CPU + 1)
+    GUNICORN_WORKER_CLASS  gthread, or gevent to keep thousands of idle or
+                           slow connections open in each process
+    GUNICORN_THREADS       the requests run at once by a gthread worker (32)
+    GUNICORN_CONNECTIONS   the connections of a gevent worker (1000)
+    GUNICORN_TIMEOUT       the seconds a request can take (30)
+    PROMETHEUS_MULTIPROC_DIR
+                           where the workers write their metrics so that
+                           "/metrics" sums them (smilecook-metrics in the
+                           temporary directory)
+
+The process pools and the mail queue of the app start on their first use,
+so they are created in each worker after the fork. Each worker has a pool
+for the images and one for the passwords, of IMAGE_POOL_WORKERS and
+PASSWORD_POOL_WORKERS processes (1 each), and every one of them imports the
+app. A host thus runs workers x 3 processes of the app with the defaults,
+17 x 3 = 51 on 8 CPUs, so the pools should only be made larger along with
+fewer workers.
+
+Each worker opens up to GUNICORN_THREADS + 4 connections to the database
+(DATABASE_POOL_SIZE and DATABASE_MAX_OVERFLOW change it), and as many to
+the replica when there is one. A host thus needs workers x 36 connections
+of each database with the defaults, 17 x 36 = 612 on 8 CPUs, well past the
+100 PostgreSQL accepts by default: either raise max_connections, put a
+pooler such as PgBouncer in front of it, or lower GUNICORN_WORKERS,
+GUNICORN_THREADS or DATABASE_POOL_SIZE so that the product fits. A gevent
+worker shares its pool between its connections, which wait up to
+DATABASE_POOL_TIMEOUT (10 seconds) for one.
+"""
+import glob
+import multiprocessing
+import os
+import tempfile
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS',
+                        multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+worker_connections = int(os.getenv('GUNICORN_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+# the app is loaded in each worker, after the fork, so that no database
+# connection or thread is shared between the workers.
+preload_app = False
+accesslog = '-'
+# set before the workers are forked so that they all share it
+metrics_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'smilecook-metrics'))
+
+
+def on_starting(server):
+    # the counters start from 0 with the server, the files of the workers of
+    # a previous run are dropped.
+    for path in glob.glob(os.path.join(metrics_dir, 'metrics-*.json')):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    # psycopg2 blocks the whole gevent worker on each query unless it is
+    # made cooperative.
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            return
+        patch_psycopg()
@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+
+from passlib.hash import pbkdf2_sha256
+from werkzeug.exceptions import ServiceUnavailable
+
+from jobs import ProcessPool
+
+logger = logging.getLogger(__name__)
+
+
+def hash_with_rounds(password, rounds):
+    return pbkdf2_sha256.using(rounds=rounds).hash(password)
+
+
+def verify_hash(password, hashed):
+    return pbkdf2_sha256.verify(password, hashed)
+
+
+class PasswordHasher:
+    """
+    This class hashes and verifies the passwords in a process pool, so a
+    burst of logins does not hold the GIL of the workers serving the other
+    requests. It is configured through the app config:
+
+        PASSWORD_HASH_ROUNDS     the pbkdf2 rounds of the new hashes
+        PASSWORD_POOL_WORKERS    the number of processes (1)
+        PASSWORD_POOL_QUEUE_SIZE the number of calls waiting or running at
+                                 once, further calls wait for a slot (64)
+        PASSWORD_POOL_TIMEOUT    how long a call waits for a slot before
+                                 the request fails with a 503 (5 seconds)
+
+    The duration of each call is recorded in metrics.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.pool = ProcessPool('PASSWORD_POOL')
+        self.rounds = pbkdf2_sha256.default_rounds
+        self.timeout = 5
+        self.slots = threading.BoundedSemaphore(64)
+
+    def init_app(self, app):
+        self.pool.init_app(app)
+        self.rounds = app.config.get('PASSWORD_HASH_ROUNDS', self.rounds)
+        self.timeout = app.config.get('PASSWORD_POOL_TIMEOUT', self.timeout)
+        self.slots = threading.BoundedSemaphore(
+            app.config.get('PASSWORD_POOL_QUEUE_SIZE', 64))
+
+    def run(self, name, func, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise ServiceUnavailable('Too many requests, try again later')
+
+        start = time.perf_counter()
+        try:
+            return self.pool.submit(func, *args).result()
+        finally:
+            self.slots.release()
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, duration):
+        self.metrics.observe('password_seconds', duration, operation=name)
+        logger.debug('password %s took %.1fms', name, duration * 1000)
+
+    def hash(self, password):
+        return self.run('hash', hash_with_rounds, password, self.rounds)
+
+    def verify(self, password, hashed):
+        return self.run('verify', verify_hash, password, hashed)
+
+    def verify_and_update(self, password, hashed):
+        """
+        This method verifies a password and returns a new hash of it when
+        the stored one was made with other parameters than the current
+        ones, or None when it is still up to date.
+        """
+        if not self.verify(password, hashed):
+            return False, None
+
+        if pbkdf2_sha256.using(rounds=self.rounds).needs_update(hashed):
+            return True, self.hash(password)
+
+        return True, None
@@ -0,0 +1,143 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    This class runs jobs outside of the request in background worker
+    threads. A job that raises is retried with an exponential backoff until
+    it runs out of attempts, unless retry_if, given the exception, tells
+    that the failure is permanent. It is configured through the app config
+    with the prefix given to the constructor, e.g. for 'MAIL_QUEUE':
+
+        MAIL_QUEUE_WORKERS  the number of worker threads (2)
+        MAIL_QUEUE_RETRIES  the number of retries of a failed job (5)
+        MAIL_QUEUE_BACKOFF  the delay before the first retry in seconds (1)
+    """
+
+    def __init__(self, prefix, retry_if=None):
+        self.prefix = prefix
+        self.retry_if = retry_if or (lambda error: True)
+        self.queue = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.num_workers = 2
+        self.retries = 5
+        self.backoff = 1.0
+
+    def init_app(self, app):
+        self.num_workers = app.config.get(
+            '{}_WORKERS'.format(self.prefix), self.num_workers)
+        self.retries = app.config.get(
+            '{}_RETRIES'.format(self.prefix), self.retries)
+        self.backoff = app.config.get(
+            '{}_BACKOFF'.format(self.prefix), self.backoff)
+
+    def start(self):
+        # the workers are started on the first job rather than in init_app so
+        # that no thread exists yet when a server forks its workers.
+        with self.lock:
+            self.workers = [worker for worker in self.workers
+                            if worker.is_alive()]
+            while len(self.workers) < self.num_workers:
+                worker = threading.Thread(
+                    target=self.work, daemon=True,
+                    name='{}-{}'.format(self.prefix, len(self.workers)))
+                worker.start()
+                self.workers.append(worker)
+
+    def enqueue(self, func, *args, **kwargs):
+        """This method schedules func(*args, **kwargs) and returns at once"""
+        if len(self.workers) < self.num_workers:
+            self.start()
+        self.queue.put((func, args, kwargs))
+
+    def join(self):
+        """This method blocks until every scheduled job is done"""
+        self.queue.join()
+
+    def work(self):
+        while True:
+            func, args, kwargs = self.queue.get()
+            try:
+                self.run(func, args, kwargs)
+            finally:
+                self.queue.task_done()
+
+    def run(self, func, args, kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except Exception as error:
+                if attempt == self.retries or not self.retry_if(error):
+                    logger.exception('%s job %s failed, giving up',
+                                     self.prefix, func.__name__)
+                    return None
+                delay = self.backoff * 2 ** attempt
+                logger.warning('%s job %s failed, retrying in %ss',
+                               self.prefix, func.__name__, delay,
+                               exc_info=True)
+                time.sleep(delay)
+
+
+class ProcessPool:
+    """
+    This class runs CPU bound work in a pool of processes so that it does not
+    hold the GIL of the worker serving the requests. The pool is created on
+    the first job and configured through the app config with the prefix
+    given to the constructor, e.g. IMAGE_POOL_WORKERS for 'IMAGE_POOL'
+    (1 by default). Each gunicorn worker has its own pools, which already
+    gives the host several processes per CPU, see gunicorn.conf.py.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.executor = None
+        self.lock = threading.Lock()
+        self.num_workers = 1
+
+    def init_app(self, app):
+        self.num_workers = app.config.get(
+            '{}_WORKERS'.format(self.prefix), self.num_workers)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # spawn rather than fork since the parent runs threads
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+
+            return self.executor
+
+    def submit(self, func, *args, **kwargs):
+        """
+        This method schedules func(*args, **kwargs) and returns a future. A
+        pool one of whose processes died (e.g. killed for its memory) fails
+        every job from then on, so it is replaced by a new one. The jobs it
+        was running fail with BrokenProcessPool.
+        """
+        executor = self.get_executor()
+        try:
+            return executor.submit(func, *args, **kwargs)
+        except BrokenProcessPool:
+            logger.warning('%s is broken, starting a new one', self.prefix)
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            executor.shutdown(wait=False)
+
+        return self.get_executor().submit(func, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=wait)
+                self.executor = None
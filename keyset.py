@@ -0,0 +1,151 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from sqlalchemy import and_, asc, desc, or_
+
+# the databases that sort NULL before every value, the others sort it after
+NULLS_FIRST_DIALECTS = ('sqlite', 'mysql', 'mariadb', 'mssql')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, value, id):
+    """
+    This function turns a position in a list into an opaque cursor.
+    Timestamps are not stored in the cursor, they are looked up again by id
+    so that they are compared in the format the database stored them in.
+    The value of a row whose nullable sort column is NULL is stored as None.
+    """
+    if isinstance(value, datetime):
+        value = None
+
+    return urlsafe_b64encode(
+        json.dumps([direction, value, id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        direction, value, id = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+    # the value is compared with the sort column, a list or a dict would
+    # reach the database
+    if direction not in ('next', 'prev') or not isinstance(id, int) \
+            or not isinstance(value, (int, float, str, type(None))):
+        raise InvalidCursor(cursor)
+
+    return direction, value, id
+
+
+class KeysetPagination:
+    """
+    This class pages through a query by seeking on (sort column, id) instead
+    of using an OFFSET, so every page costs the same no matter how deep it is.
+    It exposes the same attributes as the Flask-SQLAlchemy pagination object
+    so that it can be dumped by the PaginationSchema, page and pages are None
+    and total is only set when the caller already knows it.
+
+    When the sort column is nullable the rows whose value is NULL are paged
+    through as a segment of their own, placed where the database sorts NULL,
+    since comparing with NULL or wrapping the column in an expression would
+    keep the database from seeking in the index of the column.
+    """
+    page = None
+    pages = None
+
+    def __init__(self, query, sort_column, id_column, order, per_page,
+                 cursor, total=None, nullable=False):
+        self.per_page = per_page
+        self.total = total
+
+        if cursor:
+            direction, value, id = decode_cursor(cursor)
+        else:
+            direction, value, id = 'next', None, None
+
+        # walking backwards is done by reversing the order and flipping the
+        # rows once fetched
+        descending = (order == 'desc') != (direction == 'prev')
+        sort_logic = desc if descending else asc
+        query = query.order_by(None) \
+            .order_by(sort_logic(sort_column), sort_logic(id_column)) \
+            .add_columns(sort_column)
+
+        if not nullable:
+            segments = ['values']
+        else:
+            nulls_first = query.session.get_bind().dialect.name \
+                in NULLS_FIRST_DIALECTS
+            segments = ['nulls', 'values'] if nulls_first != descending \
+                else ['values', 'nulls']
+            if id is not None:
+                # the rows are walked from the segment of the cursor on
+                start = 'nulls' if value is None else 'values'
+                segments = segments[segments.index(start):]
+
+        rows = []
+        for segment in segments:
+            if segment == 'nulls':
+                segment_query = query.filter(sort_column.is_(None))
+                if id is not None and value is None:
+                    segment_query = segment_query.filter(
+                        id_column < id if descending else id_column > id)
+            else:
+                segment_query = query.filter(sort_column.isnot(None)) \
+                    if nullable else query
+                if id is not None and (value is not None or not nullable):
+                    segment_query = segment_query.filter(self.seek(
+                        query, sort_column, id_column, descending, value, id))
+
+            rows.extend(segment_query.limit(per_page + 1 - len(rows)).all())
+            if len(rows) > per_page:
+                break
+            # the next segment is walked from its start
+            id = None
+
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if direction == 'prev':
+            rows.reverse()
+
+        self.items = [row[0] for row in rows]
+        self._keys = [(row[1], row[0].id) for row in rows]
+
+        if direction == 'next':
+            self.has_next = has_more
+            self.has_prev = bool(cursor)
+        else:
+            self.has_next = True
+            self.has_prev = has_more
+
+    @staticmethod
+    def seek(query, sort_column, id_column, descending, value, id):
+        """
+        This method returns the filter of the rows that come after (value,
+        id) in the order of the list, value is looked up by id when None.
+        """
+        if value is None:
+            value = query.session.query(sort_column) \
+                .filter(id_column == id).scalar_subquery()
+        if descending:
+            return or_(sort_column < value, and_(sort_column == value,
+                                                 id_column < id))
+
+        return or_(sort_column > value, and_(sort_column == value,
+                                             id_column > id))
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self._keys:
+            return None
+        return encode_cursor('next', *self._keys[-1])
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self._keys:
+            return None
+        return encode_cursor('prev', *self._keys[0])
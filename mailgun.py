@@ -1,12 +1,34 @@
 import requests
 
+
+def is_transient(error):
+    """
+    This function tells if sending a message failed in a way that is worth
+    retrying: the API could not be reached, was rate limited or failed on
+    its side. A 4xx such as a bad address or key fails the same way again.
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
 class MailgunApi:
     API_URL = "https://api.mailgun.net/v3/{}/messages"
     
-    def __init__(self, domain, api_key):
+    def __init__(self, domain, api_key, api_url=None, transport=None,
+                 timeout=10):
+        """
+        api_url and transport allow the messages to be sent somewhere else
+        than Mailgun, e.g. to a local stub server in tests. transport is any
+        object with a requests-like post method.
+        """
         self.domain = domain
         self.api_key = api_key
-        self.base_url = self.API_URL.format(self.domain)
+        self.base_url = (api_url or self.API_URL).format(self.domain)
+        self.transport = transport or requests
+        self.timeout = timeout
         
     def send_email(self, to, subject,text, html=None):
         
@@ -21,7 +43,11 @@ class MailgunApi:
             'html': html
         }
         
-        response = requests.post(url=self.base_url, auth=('api', self.api_key),
-                                data=data)
+        response = self.transport.post(url=self.base_url,
+                                       auth=('api', self.api_key),
+                                       data=data, timeout=self.timeout)
+        # raising lets the mail queue retry the messages that failed, see
+        # is_transient
+        response.raise_for_status()
         
-        return response
\ No newline at end of file
+        return response
@@ -0,0 +1,254 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                   5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts, total, count):
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+        self.count += count
+
+
+class Metrics:
+    """
+    This class collects the metrics of the app and renders them in the
+    Prometheus text format on "/metrics":
+
+        smilecook_request_seconds       latency per endpoint
+        smilecook_db_queries            SQL statements per request
+        smilecook_db_query_seconds      duration of each SQL statement
+        smilecook_cache_requests_total  cache hits and misses per cache
+        smilecook_serializer_seconds    duration of the schema dumps
+        smilecook_compress_seconds      duration of the response compression
+        smilecook_password_seconds      duration of the password hashing
+
+    Recording a value only takes a lock and a few additions. The metrics
+    are kept per process, a scrape reaches a single worker, so when
+    METRICS_DIR (or PROMETHEUS_MULTIPROC_DIR) is set each worker writes its
+    metrics to a file of its own there, METRICS_FLUSH_INTERVAL seconds (1)
+    after a request, and "/metrics" sums the files of every worker. The files
+    of the workers that exited are kept so that the counters never go
+    down, gunicorn.conf.py empties the directory when the server starts.
+    """
+
+    def __init__(self, prefix='smilecook'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.directory = None
+        self.flush_interval = 1
+        self.flush_lock = threading.Lock()
+        self.flush_timer = None
+
+    def init_app(self, app):
+        self.directory = app.config.get(
+            'METRICS_DIR', os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL',
+                                             self.flush_interval)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        # listening on the Engine class covers every engine of the app
+        if not event.contains(Engine, 'before_cursor_execute',
+                              self.before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         self.before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         self.after_cursor_execute)
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+
+    def after_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unknown'
+            self.observe('request_seconds', time.perf_counter() - start,
+                         endpoint=endpoint, method=request.method)
+            self.observe('db_queries', g.pop('metrics_queries', 0),
+                         buckets=COUNT_BUCKETS, endpoint=endpoint)
+        if self.directory:
+            self.schedule_flush()
+
+        return response
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'histograms': [[name, labels, histogram.buckets,
+                                list(histogram.counts), histogram.sum,
+                                histogram.count]
+                               for (name, labels), histogram
+                               in self.histograms.items()],
+                'counters': [[name, labels, value] for (name, labels), value
+                             in self.counters.items()],
+            }
+
+    def schedule_flush(self):
+        """
+        This method writes the metrics flush_interval seconds from now,
+        unless it is already planned, so the file of a worker is written
+        once for a burst of requests and is up to date once it is idle.
+        """
+        with self.lock:
+            if self.flush_timer is not None:
+                return
+            timer = self.flush_timer = threading.Timer(
+                self.flush_interval, self.scheduled_flush)
+            timer.daemon = True
+        timer.start()
+
+    def scheduled_flush(self):
+        with self.lock:
+            self.flush_timer = None
+        self.flush()
+
+    def flush(self):
+        """This method writes the metrics of the process to its file"""
+        with self.flush_lock:
+            path = os.path.join(self.directory,
+                                'metrics-{}.json'.format(os.getpid()))
+            with open(path + '.tmp', 'w') as output:
+                json.dump(self.snapshot(), output)
+            # replaced at once so that a scrape never reads half a file
+            os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """
+        This method returns the histograms and the counters of the process,
+        or the sum of those of every worker when METRICS_DIR is set.
+        """
+        if not self.directory:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory,
+                                               'metrics-*.json')):
+                try:
+                    with open(path) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+
+        histograms = {}
+        counters = {}
+        for snapshot in snapshots:
+            for name, labels, buckets, counts, total, count \
+                    in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = histograms.get(key)
+                if histogram is None:
+                    histogram = histograms[key] = Histogram(tuple(buckets))
+                histogram.merge(counts, total, count)
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+
+        return histograms, counters
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        starts = conn.info.get('metrics_start')
+        if starts:
+            self.observe('db_query_seconds',
+                         time.perf_counter() - starts.pop())
+        if g and 'metrics_queries' in g:
+            g.metrics_queries += 1
+
+    def render(self):
+        lines = []
+        typed = set()
+        histograms, counters = self.collect()
+        histograms = sorted(histograms.items())
+        counters = sorted(counters.items())
+
+        for (name, labels), histogram in histograms:
+            name = '{}_{}'.format(self.prefix, name)
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} histogram'.format(name))
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',),
+                                    histogram.counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels + (('le', bound),)),
+                    cumulative))
+            lines.append('{}_sum{} {}'.format(
+                name, format_labels(labels), histogram.sum))
+            lines.append('{}_count{} {}'.format(
+                name, format_labels(labels), histogram.count))
+
+        for (name, labels), value in counters:
+            name = '{}_{}'.format(self.prefix, name)
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} counter'.format(name))
+            lines.append('{}{} {}'.format(
+                name, format_labels(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"')) for key, value in labels))
@@ -1,9 +1,25 @@
-from sqlalchemy import asc, desc, or_
+from sqlalchemy import asc, desc, inspect
+from sqlalchemy.orm import joinedload
 
 from extensions import db
+from keyset import KeysetPagination
+from models.recipe_search import RecipeSearchTerm, FIELD_WEIGHTS, tokenize
+from models.user import User
 
 class Recipe(db.Model):
     __tablename__ = 'recipe'
+    # the indexes match the filters and sorts of get_all_published and
+    # get_all_by_user, id comes last since it breaks the ties of the sort.
+    __table_args__ = (
+        db.Index('ix_recipe_publish_created_at', 'is_publish', 'created_at',
+                 'id'),
+        db.Index('ix_recipe_publish_cook_time', 'is_publish', 'cook_time',
+                 'id'),
+        db.Index('ix_recipe_publish_num_of_servings', 'is_publish',
+                 'num_of_servings', 'id'),
+        db.Index('ix_recipe_user_publish_created_at', 'user_id',
+                 'is_publish', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -21,65 +37,169 @@ class Recipe(db.Model):
     user_id = db.Column(db.Integer(), db.ForeignKey("user.id"))
         
     @classmethod
-    def get_all_published(cls, q, page, per_page, sort, order):
-        keyword = "%{}%".format(q)
-        
+    def search(cls, q, sort):
+        """
+        This method builds the query used by the recipe lists along with the
+        column it is sorted on. When q holds searchable terms the recipes are
+        matched through the search index instead of scanning the recipe table.
+        """
+        # the authors are loaded in the same query since every recipe of a
+        # list is dumped with its author.
+        query = cls.query.options(joinedload(cls.user))
+        matches = RecipeSearchTerm.match(q)
+
+        if matches is not None:
+            query = query.join(matches, matches.c.recipe_id == cls.id)
+
+        if sort == 'relevance':
+            sort_column = matches.c.score if matches is not None \
+                else cls.created_at
+        else:
+            sort_column = getattr(cls, sort)
+
+        return query, sort_column
+
+    @classmethod
+    def get_page(cls, query, sort_column, order, page, per_page, cursor,
+                 total=None):
+        """
+        This method pages through a recipe list. When a cursor is given
+        (an empty one being the first page) keyset pagination is used instead
+        of an OFFSET, and the total count is not computed. When the total is
+        already known it is used instead of counting the recipes.
+        """
+        if cursor is not None:
+            # the relevance score of a search is not a column of the table
+            nullable = getattr(sort_column.expression, 'nullable', False)
+            return KeysetPagination(query, sort_column, cls.id, order,
+                                    per_page, cursor, total=total,
+                                    nullable=nullable)
+
         if order == 'desc':
-            sort_logic = desc(getattr(cls, sort))
+            sort_logic = desc(sort_column)
+            id_logic = desc(cls.id)
         else:
-            sort_logic = asc(getattr(cls, sort))
-            
-            
-        return cls.query.filter(or_(cls.name.ilike(keyword), 
-                                    cls.description.ilike(keyword),
-                                    cls.ingredients.ilike(keyword)),
-                                cls.is_publish.is_(True)). \
-                order_by(sort_logic).paginate(page=page, per_page=per_page)
+            sort_logic = asc(sort_column)
+            id_logic = asc(cls.id)
+
+        pagination = query.order_by(sort_logic, id_logic) \
+            .paginate(page=page, per_page=per_page, count=total is None)
+        if total is not None:
+            pagination.total = total
+        
+        return pagination
+
+    @classmethod
+    def get_all_published(cls, q, page, per_page, sort, order, cursor=None):
+        query, sort_column = cls.search(q, sort)
+        query = query.filter(cls.is_publish.is_(True))
+        
+        return cls.get_page(query, sort_column, order, page, per_page, cursor)
     
     @classmethod
     def get_by_id(cls, recipe_id):
         return cls.query.filter_by(id=recipe_id).first()
     
+    @classmethod
+    def cover_in_use(cls, filename):
+        return db.session.query(
+            cls.query.filter_by(cover_image=filename).exists()).scalar()
+    
     @classmethod
     def get_all_by_user(cls, q, page, per_page, 
-                        sort, order,user_id, visibility='public'):
+                        sort, order,user_id, visibility='public', cursor=None,
+                        total=None):
         
         """
         This method is used to filter the recipes a logged in user can see
         from an author. based on the user and the visibility assigned by the
-        author.
+        author. total is the number of recipes for the visibility, from the
+        counters of the author, it is only used when q does not filter them.
         """
+        if tokenize(q):
+            total = None
         
-        keyword = "%{}%".format(q)
-        
-        if order == 'desc':
-            sort_logic = desc(getattr(cls, sort))
-        else:
-            sort_logic = asc(getattr(cls, sort))
+        query, sort_column = cls.search(q, sort)
+        query = query.filter_by(user_id=user_id)
                     
         if visibility == 'public':
-            return cls.query.filter(
-                or_(cls.name.ilike(keyword), cls.description.ilike(keyword))) \
-                .filter_by(user_id = user_id, is_publish=True) \
-                .order_by(sort_logic).paginate(page=page, per_page=per_page)
-                
+            query = query.filter_by(is_publish=True)
         elif visibility == 'private':
-            return cls.query.filter(
-                or_(cls.name.ilike(keyword), cls.description.ilike(keyword))) \
-                .filter_by(user_id = user_id, is_publish = False) \
-                .order_by(sort_logic).paginate(page=page, per_page=per_page)
-                
-        else:
-            return cls.query.filter(
-                or_(cls.name.ilike(keyword),cls.description.ilike(keyword))) \
-                .filter_by(user_id = user_id) \
-                .order_by(sort_logic).paginate(page=page, per_page=per_page)
+            query = query.filter_by(is_publish=False)
+            
+        return cls.get_page(query, sort_column, order, page, per_page, cursor,
+                            total=total)
             
-          
+    @classmethod
+    def bulk_create(cls, rows, user_id):
+        """
+        This method creates a recipe of user_id for each row of validated
+        data and indexes them in a single transaction. The rows are flushed
+        together so the inserts are batched where the database allows it.
+        """
+        recipes = [cls(user_id=user_id, **row) for row in rows]
+        published = sum(1 for recipe in recipes if recipe.is_publish)
+        
+        db.session.add_all(recipes)
+        db.session.flush()
+        RecipeSearchTerm.index_new_recipes(recipes)
+        User.update_recipe_counts(user_id, published,
+                                  len(recipes) - published)
+        db.session.commit()
+        User.uncache(user_id)
+        
+        return len(recipes)
+    
+    @classmethod
+    def get_all_for_export(cls, batch_size):
+        """
+        This method returns the published recipes with their authors, read
+        from a server side cursor batch_size rows at a time.
+        """
+        return cls.query.options(joinedload(cls.user)) \
+            .filter(cls.is_publish.is_(True)).order_by(cls.id) \
+            .execution_options(stream_results=True).yield_per(batch_size)
+    
+    def count_changes(self):
+        """
+        This method returns how the published and draft counters of the
+        author change when the recipe is saved.
+        """
+        state = inspect(self)
+        if state.transient or state.pending:
+            return (1, 0) if self.is_publish else (0, 1)
+        
+        history = state.attrs.is_publish.history
+        was_published = bool(history.deleted and history.deleted[0])
+        if not history.has_changes() or was_published == bool(
+                self.is_publish):
+            return 0, 0
+        
+        return (1, -1) if self.is_publish else (-1, 1)
+    
     def save(self):
+        state = inspect(self)
+        reindex = state.transient or state.pending or any(
+            state.attrs[field].history.has_changes()
+            for field in FIELD_WEIGHTS)
+        published, draft = self.count_changes()
+        user_id = self.user_id
+        
         db.session.add(self)
+        if reindex:
+            db.session.flush()
+            RecipeSearchTerm.index_recipe(self)
+        User.update_recipe_counts(user_id, published, draft)
         db.session.commit()
+        if published or draft:
+            User.uncache(user_id)
         
     def delete(self):
+        user_id = self.user_id
+        published, draft = (-1, 0) if self.is_publish else (0, -1)
+        
+        RecipeSearchTerm.remove_recipe(self.id)
         db.session.delete(self)
-        db.session.commit()
\ No newline at end of file
+        User.update_recipe_counts(user_id, published, draft)
+        db.session.commit()
+        User.uncache(user_id)
\ No newline at end of file
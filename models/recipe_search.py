@@ -0,0 +1,130 @@
+import re
+from collections import Counter
+
+from sqlalchemy import func, literal, union_all
+
+from extensions import db
+
+# weight given to a term depending on the field it was found in, a match in
+# the name of a recipe counts more than one in its ingredients.
+FIELD_WEIGHTS = {'name': 3, 'description': 2, 'ingredients': 1}
+
+STOP_WORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from',
+              'in', 'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with'}
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+# the characters of the terms in the order the databases sort them
+TERM_CHARACTERS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def tokenize(text):
+    """
+    This function splits a text into the normalized terms stored in the
+    search index. The same function is used for the recipes and the queries
+    so that both sides always agree on what a term is.
+    """
+    if not text:
+        return []
+
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if len(token) < 2 or token in STOP_WORDS:
+            continue
+        # a very light stemming so that "eggs" matches "egg"
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        terms.append(token[:50])
+
+    return terms
+
+
+def prefix_end(prefix):
+    """
+    This function returns the first term that follows every term starting
+    with prefix, or None when there is none, so that the terms starting with
+    prefix are found through a range of the index on any database.
+    """
+    prefix = prefix.rstrip(TERM_CHARACTERS[-1])
+    if not prefix:
+        return None
+
+    return prefix[:-1] + TERM_CHARACTERS[
+        TERM_CHARACTERS.index(prefix[-1]) + 1]
+
+
+class RecipeSearchTerm(db.Model):
+    """
+    This class is the inverted index used to search recipes. Each row links a
+    term to a recipe with a weight that is used to rank the results.
+    """
+    __tablename__ = 'recipe_search_term'
+
+    term = db.Column(db.String(50), primary_key=True)
+    recipe_id = db.Column(db.Integer(),
+                          db.ForeignKey('recipe.id', ondelete='CASCADE'),
+                          primary_key=True, index=True)
+    weight = db.Column(db.Integer(), nullable=False)
+
+    @classmethod
+    def index_recipe(cls, recipe):
+        """This method replaces the index entries of a recipe"""
+        cls.remove_recipe(recipe.id)
+        db.session.bulk_insert_mappings(cls, cls.entries(recipe))
+
+    @classmethod
+    def index_new_recipes(cls, recipes):
+        """
+        This method indexes recipes that have no index entries yet, with a
+        single statement for all of them.
+        """
+        db.session.bulk_insert_mappings(cls, [
+            entry for recipe in recipes for entry in cls.entries(recipe)])
+
+    @staticmethod
+    def entries(recipe):
+        weights = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(getattr(recipe, field)):
+                weights[term] += weight
+
+        return [{'term': term, 'recipe_id': recipe.id, 'weight': weight}
+                for term, weight in weights.items()]
+
+    @classmethod
+    def remove_recipe(cls, recipe_id):
+        cls.query.filter_by(recipe_id=recipe_id). \
+            delete(synchronize_session=False)
+
+    @classmethod
+    def match(cls, q):
+        """
+        This method returns a subquery of the ids of the recipes matching
+        every term of q along with their relevance score, or None when q
+        holds no searchable term. Each term of q matches the terms it is a
+        prefix of, so "chick" finds "chicken" as the former substring search
+        did.
+        """
+        terms = sorted(set(tokenize(q)))
+        if not terms:
+            return None
+
+        selects = []
+        for position, term in enumerate(terms):
+            select = db.session.query(
+                cls.recipe_id.label('recipe_id'),
+                cls.weight.label('weight'),
+                literal(position).label('position')) \
+                .filter(cls.term >= term)
+            end = prefix_end(term)
+            if end is not None:
+                select = select.filter(cls.term < end)
+            selects.append(select)
+        found = union_all(*[select.statement for select in selects]) \
+            .subquery()
+
+        return db.session.query(
+            found.c.recipe_id.label('recipe_id'),
+            func.sum(found.c.weight).label('score')) \
+            .group_by(found.c.recipe_id) \
+            .having(func.count(found.c.position.distinct()) == len(terms)) \
+            .subquery()
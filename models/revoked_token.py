@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from extensions import db
+
+class RevokedToken(db.Model):
+    """
+    This class stores the tokens revoked through the "/revoke" endpoint
+    until they expire, after which they can no longer be used anyway.
+    """
+    __tablename__ = 'revoked_token'
+    
+    jti = db.Column(db.String(36), primary_key=True)
+    expires_at = db.Column(db.DateTime(), index=True)
+    
+    @classmethod
+    def exists(cls, jti):
+        return db.session.query(
+            cls.query.filter_by(jti=jti).exists()).scalar()
+    
+    @classmethod
+    def purge_expired(cls):
+        cls.query.filter(cls.expires_at < datetime.utcnow()). \
+            delete(synchronize_session=False)
+    
+    def save(self):
+        db.session.merge(self)
+        db.session.commit()
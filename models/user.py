@@ -1,4 +1,13 @@
-from extensions import db
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from extensions import db, cache, metrics
+from routing import primary
+
+# cached under the username and email keys of the users that do not exist,
+# the ids start at 1.
+NOT_FOUND = 0
 
 class User(db.Model):
     __tablename__ = 'user'
@@ -13,20 +22,163 @@ class User(db.Model):
     updated_at = db.Column(db.DateTime(), nullable=False,
                         server_default=db.func.now(), onupdate=db.func.now())
     avatar_image = db.Column(db.String(100), default=None)
+    # kept up to date by Recipe.save and Recipe.delete so that showing them
+    # does not count the recipes each time.
+    published_recipe_count = db.Column(db.Integer(), nullable=False,
+                                       default=0, server_default='0')
+    draft_recipe_count = db.Column(db.Integer(), nullable=False, default=0,
+                                   server_default='0')
     recipes = db.relationship('Recipe', backref='user')
     
+    @property
+    def recipe_count(self):
+        return self.published_recipe_count + self.draft_recipe_count
+    
+    def count_recipes(self, visibility='public'):
+        """
+        This method returns the number of recipes listed for a visibility of
+        get_all_by_user.
+        """
+        if visibility == 'public':
+            return self.published_recipe_count
+        elif visibility == 'private':
+            return self.draft_recipe_count
+        
+        return self.recipe_count
+    
+    @classmethod
+    def update_recipe_counts(cls, user_id, published=0, draft=0):
+        """
+        This method adds to the counters of a user in the current
+        transaction. It is a single UPDATE so that concurrent changes to the
+        recipes of a user do not overwrite each other's counts.
+        """
+        if not published and not draft:
+            return
+        
+        cls.query.filter_by(id=user_id).update({
+            cls.published_recipe_count: cls.published_recipe_count +
+            published,
+            cls.draft_recipe_count: cls.draft_recipe_count + draft
+        }, synchronize_session=False)
+    
+    @classmethod
+    def uncache(cls, user_id):
+        cache.delete('user:id:{}'.format(user_id))
+    
     @classmethod
     def get_by_username(cls, username):
-        return cls.query.filter_by(username=username).first()
+        return cls.get_cached('username', username)
     
     @classmethod
     def get_by_email(cls, email):
-        return cls.query.filter_by(email=email).first()
+        return cls.get_cached('email', email)
     
     @classmethod
     def get_by_id(cls, id):
-        return cls.query.filter_by(id=id).first()
+        values = cache.get('user:id:{}'.format(id))
+        if values is not None:
+            metrics.inc('cache_requests_total', cache='user', result='hit')
+            return cls.from_cache(values)
+        
+        metrics.inc('cache_requests_total', cache='user', result='miss')
+        # the cache is shared by every caller, see RoutingSession
+        with primary():
+            user = cls.query.filter_by(id=id).first()
+        if user is not None:
+            cls.cache_user(user)
+        
+        return user
+    
+    @classmethod
+    def avatar_in_use(cls, filename):
+        return db.session.query(
+            cls.query.filter_by(avatar_image=filename).exists()).scalar()
+    
+    @classmethod
+    def get_cached(cls, field, value):
+        """
+        This method returns the user whose field (username or email) holds
+        value. The cache maps the value to the id of the user, or to
+        NOT_FOUND for the values that match no user so that probing for
+        unknown usernames does not reach the database each time. The users
+        are read from the primary since they are cached for every caller.
+        """
+        key = 'user:{}:{}'.format(field, value)
+        user_id = cache.get(key)
+        
+        if user_id == NOT_FOUND:
+            metrics.inc('cache_requests_total', cache='user', result='hit')
+            return None
+        if user_id is not None:
+            user = cls.get_by_id(user_id)
+            if user is not None and getattr(user, field) == value:
+                return user
+        
+        with primary():
+            user = cls.query.filter_by(**{field: value}).first()
+        config = current_app.config
+        if user is None:
+            cache.set(key, NOT_FOUND, timeout=config.get(
+                'USER_CACHE_NEGATIVE_TIMEOUT', 60))
+        else:
+            cache.set(key, user.id, timeout=config.get(
+                'USER_CACHE_TIMEOUT', 300))
+            cls.cache_user(user)
+        
+        return user
+    
+    @classmethod
+    def get_password(cls, user_id):
+        """
+        This method reads the password hash of a user, which is left out of
+        the cache so that it only leaves the database to be checked.
+        """
+        with primary():
+            return db.session.query(cls.password).filter_by(
+                id=user_id).scalar()
+    
+    @classmethod
+    def cache_user(cls, user):
+        values = {column.key: getattr(user, column.key)
+                  for column in inspect(cls).column_attrs
+                  if column.key != 'password'}
+        cache.set('user:id:{}'.format(user.id), values,
+                  timeout=current_app.config.get('USER_CACHE_TIMEOUT', 300))
+    
+    @classmethod
+    def from_cache(cls, values):
+        """
+        This method attaches a cached user to the session without a query,
+        as if it had been loaded. The user already in the session is
+        returned when there is one.
+        """
+        user = cls(**values)
+        make_transient_to_detached(user)
+        
+        return db.session.merge(user, load=False)
+    
+    def cache_keys(self):
+        """
+        This method returns the cache keys of the user, including the ones
+        of the username and email it is changed from.
+        """
+        keys = []
+        state = inspect(self)
+        if self.id is not None:
+            keys.append('user:id:{}'.format(self.id))
+        for field in ('username', 'email'):
+            values = {getattr(self, field),
+                      *state.attrs[field].history.deleted}
+            keys.extend('user:{}:{}'.format(field, value) for value in values
+                        if value is not None)
+        
+        return keys
     
     def save(self):
+        keys = self.cache_keys()
         db.session.add(self)
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+        # the keys are dropped once committed so that they are not filled
+        # again with the previous values in the meantime.
+        cache.delete_many(*keys)
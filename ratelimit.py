@@ -0,0 +1,59 @@
+from flask import current_app, g
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_limiter.util import get_remote_address
+
+# the limits used unless RATELIMIT_AUTHENTICATED and RATELIMIT_ANONYMOUS are
+# set, the anonymous callers share the limit of their address.
+AUTHENTICATED_LIMIT = '60 per minute'
+ANONYMOUS_LIMIT = '2 per minute'
+
+
+def get_identity():
+    """
+    This function returns the identity of the access token of the request,
+    or None when there is none or it is not valid, in which case the
+    endpoint rejects it on its own if it requires one. The token is verified
+    once per request, the identity is kept in g for the other callers.
+    """
+    if 'jwt_identity' not in g:
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            g.jwt_identity = None
+        else:
+            g.jwt_identity = get_jwt_identity()
+
+    return g.jwt_identity
+
+
+def rate_limit_key():
+    """
+    This function returns the key the requests are counted under, the user
+    for the authenticated requests and the address for the others.
+    """
+    identity = get_identity()
+    if identity is not None:
+        return 'user:{}'.format(identity)
+
+    return 'address:{}'.format(get_remote_address())
+
+
+def rate_limit():
+    """This function returns the limit of the tier of the caller"""
+    if get_identity() is not None:
+        return current_app.config.get('RATELIMIT_AUTHENTICATED',
+                                      AUTHENTICATED_LIMIT)
+
+    return current_app.config.get('RATELIMIT_ANONYMOUS', ANONYMOUS_LIMIT)
+
+
+def configure_rate_limits(app):
+    """
+    This function sets the defaults of the limiter: a moving window, the
+    X-RateLimit-* headers, and a storage shared by the workers when the
+    cache is Redis (RATELIMIT_STORAGE_URI sets another one).
+    """
+    app.config.setdefault('RATELIMIT_STRATEGY', 'moving-window')
+    app.config.setdefault('RATELIMIT_HEADERS_ENABLED', True)
+    app.config.setdefault('RATELIMIT_STORAGE_URI',
+                          app.config.get('CACHE_REDIS_URL') or 'memory://')
@@ -0,0 +1,38 @@
+import os
+
+from flask import abort, current_app, send_from_directory
+from flask_restful import Resource
+
+from extensions import image_set
+from utils import HASHED_IMAGE_NAME, IMAGE_FOLDERS
+
+
+class ImageResource(Resource):
+    """
+    This class holds the logic for the "/images/<folder>/<filename>"
+    endpoint, which serves the uploaded covers and avatars.
+
+    The processed images are named after their content so they are sent with
+    a year long immutable Cache-Control, and browsers and CDNs do not ask for
+    them again. The uploads still being processed are revalidated each time.
+    The files are sent with wsgi.file_wrapper (sendfile under gunicorn), or
+    with an X-Sendfile header left to the web server when USE_X_SENDFILE is
+    set. Range and If-None-Match requests are answered with 206 and 304.
+    """
+    def get(self, folder, filename):
+        if folder not in IMAGE_FOLDERS:
+            abort(404)
+        
+        directory = os.path.join(image_set.config.destination, folder)
+        
+        if HASHED_IMAGE_NAME.match(filename):
+            response = send_from_directory(
+                directory, filename, conditional=True,
+                max_age=current_app.config.get('IMAGE_MAX_AGE', 31536000))
+            response.cache_control.immutable = True
+        else:
+            response = send_from_directory(directory, filename,
+                                           conditional=True, max_age=None)
+            response.cache_control.no_cache = True
+        
+        return response
@@ -0,0 +1,14 @@
+from flask import Response
+from flask_restful import Resource
+
+from extensions import metrics
+
+
+class MetricsResource(Resource):
+    """
+    This class holds the logic for the "/metrics" endpoint, the metrics are
+    rendered in the Prometheus text format.
+    """
+    def get(self):
+        return Response(metrics.render(),
+                        mimetype='text/plain; version=0.0.4')
@@ -1,52 +1,119 @@
-import os
-from flask import request
+import hashlib
+import json
+from functools import partial
+from flask import request, current_app, Response, stream_with_context
 from flask_restful import Resource
 from http import HTTPStatus
 from flask_jwt_extended import get_jwt_identity, jwt_required
-from marshmallow import ValidationError
+from marshmallow import EXCLUDE, ValidationError
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import http_date, is_resource_modified, quote_etag
 
 from webargs import fields
 from webargs.flaskparser import use_kwargs
 
+from keyset import InvalidCursor
 from models.recipe import Recipe
+from schema.compiled import compile_schema
 from schema.recipe import RecipeSchema, RecipePaginationSchema
-from utils import save_image, clear_cache
-from extensions import image_set, cache, limiter
+from utils import (
+    check_image, save_image, process_image, swap_image, remove_image,
+    request_cache_key, get_tagged, set_tagged, snapshot_tags, get_or_compute,
+    invalidate_tags, encode_response, json_response)
+from extensions import image_set, limiter, metrics
+from ratelimit import rate_limit
+from routing import fresh_reads, read_only
 
 
 recipe_schema = RecipeSchema()
 recipe_pagination_schema = RecipePaginationSchema()
 recipe_list_schema = RecipeSchema(many=True) 
-recipe_cover_schema = RecipeSchema(only=('cover_image',))
+recipe_cover_schema = RecipeSchema(only=('cover_image', 'cover_image_srcset'))
 # many = True is used to let the serializer (the @post_dump(pass_many)
 # decorator) know that several objects would be passed.
+# the compiled dumps give the same output as the schemas, faster, and are
+# used on the read endpoints.
+dump_recipe = compile_schema(recipe_schema)
+dump_recipe_page = compile_schema(recipe_pagination_schema)
+
+SEARCH_FIELDS = ('name', 'description', 'ingredients')
+SORT_FIELDS = ('cook_time', 'num_of_servings')
+
+
+def invalidate_recipe(recipe_id, changed=None):
+    """
+    This function invalidates the cached recipe lists affected by a change
+    to a recipe. When changed is None the recipe was added to or removed
+    from the lists, otherwise it holds the names of the fields that changed.
+    """
+    tags = ['recipe:{}'.format(recipe_id)]
+    
+    if changed is None or set(changed) & set(SEARCH_FIELDS):
+        tags.append('recipes')
+    else:
+        tags.extend('recipes:sort:{}'.format(field)
+                    for field in set(changed) & set(SORT_FIELDS))
+        
+    invalidate_tags(*tags)
+
+
+def swap_cover(recipe_id, filename, compressed_filename):
+    """This function is called once an uploaded cover has been compressed"""
+    recipe = Recipe.get_by_id(recipe_id)
+    
+    if swap_image(recipe, 'cover_image', 'covers', filename,
+                  compressed_filename, Recipe.cover_in_use,
+                  partial(swap_cover, recipe_id, filename)):
+        invalidate_recipe(recipe_id, ['cover_image'])
 
 
 class RecipeListResource(Resource):
     """
     This class holds the logic for the "/recipes" endpoint
     """
-    decorators = [limiter.limit('2 per minute', methods=['GET'],
+    decorators = [limiter.limit(rate_limit, methods=['GET'],
                                 error_message='Too many requests')]
     
+    @read_only
     @use_kwargs({
         'q': fields.String(missing=''),
         'page': fields.Int(missing=1),
         'per_page': fields.Int(missing=10),
         'sort': fields.String(missing='created_at'),
-        'order': fields.String(missing='desc')
+        'order': fields.String(missing='desc'),
+        'cursor': fields.String(missing=None)
         }, location = "query")
-    @cache.cached(timeout=60, query_string=True)
-    def get(self, q, page, per_page, sort, order):
-        
-        if sort not in ['created_at', 'cook_time', 'num_of_servings']:
+    def get(self, q, page, per_page, sort, order, cursor):
+        if sort not in ['created_at', 'cook_time', 'num_of_servings',
+                        'relevance']:
             sort = 'created_at'
         if order not in ['asc', 'desc']:
             order = 'desc'
-            
-        recipes = Recipe.get_all_published(q, page, per_page, sort, order)
+        
+        def compute():
+            recipes = Recipe.get_all_published(q, page, per_page, sort, order,
+                                               cursor=cursor)
+            with metrics.timer('serializer_seconds',
+                               schema='RecipePaginationSchema'):
+                data = dump_recipe_page(recipes)
+            # the page is tagged by the shape of the query and by the recipes
+            # it holds so that a change only drops the pages it can affect.
+            tags = ['recipes', 'recipes:sort:{}'.format(sort)]
+            tags.extend('recipe:{}'.format(recipe.id)
+                        for recipe in recipes.items)
+            return encode_response(data), tags
+        
+        # the pages are cached encoded and compressed, a hit only picks the
+        # encoding the client accepts. A page is computed by a single
+        # request at a time and an expired one is refreshed in the background.
+        try:
+            encodings = get_or_compute(
+                request_cache_key(), compute, timeout=60,
+                tags=['recipes', 'recipes:sort:{}'.format(sort)])
+        except InvalidCursor:
+            return {"message": "Invalid cursor"}, HTTPStatus.BAD_REQUEST
 
-        return recipe_pagination_schema.dump(recipes), HTTPStatus.OK
+        return json_response(encodings)
     
     @jwt_required()
     def post(self):
@@ -67,22 +134,141 @@ class RecipeListResource(Resource):
         recipe.save()
         return recipe_schema.dump(recipe), HTTPStatus.CREATED
     
+class RecipeBulkResource(Resource):
+    """
+    This class holds the logic for the "/recipes/bulk" endpoint, which
+    imports and exports recipes as NDJSON, i.e. one JSON recipe per line.
+    """
+    @staticmethod
+    def max_content_length():
+        """
+        The imports are read line by line so they are not held to the
+        MAX_CONTENT_LENGTH of the image uploads but to BULK_IMPORT_MAX_SIZE,
+        1 GiB by default, which is about two million recipes. None removes
+        the cap.
+        """
+        return current_app.config.get('BULK_IMPORT_MAX_SIZE', 1024 ** 3)
+    
+    @jwt_required()
+    def get(self):
+        # the recipes are read from a server side cursor and written out as
+        # they come so the memory used does not grow with their number.
+        batch_size = current_app.config.get('BULK_EXPORT_BATCH_SIZE', 1000)
+        
+        def generate():
+            for recipe in Recipe.get_all_for_export(batch_size):
+                yield json.dumps(dump_recipe(recipe)) + '\n'
+        
+        return Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson')
+    
+    @jwt_required()
+    def post(self):
+        """
+        This method creates a recipe of the current user for each line of
+        the body. The lines are validated like the ones of "/recipes", the
+        fields that cannot be loaded (such as the id of an exported recipe)
+        being ignored, and the valid ones are inserted in batches of
+        BULK_IMPORT_BATCH_SIZE, each batch in its own transaction.
+        """
+        # werkzeug only checks the limit on the stream since 2.3
+        limit = self.max_content_length()
+        if limit is not None and (request.content_length or 0) > limit:
+            raise RequestEntityTooLarge()
+        
+        current_user = get_jwt_identity()
+        batch_size = current_app.config.get('BULK_IMPORT_BATCH_SIZE', 1000)
+        imported = failed = 0
+        errors = []
+        batch = []
+        
+        for number, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+            try:
+                batch.append(recipe_schema.load(json.loads(line),
+                                                unknown=EXCLUDE))
+            except (ValueError, ValidationError) as err:
+                failed += 1
+                # only the first errors are returned so that a bad file does
+                # not build up a response as large as itself.
+                if len(errors) < 100:
+                    errors.append({
+                        "line": number,
+                        "errors": err.messages if isinstance(
+                            err, ValidationError) else "Invalid JSON"
+                    })
+                continue
+            
+            if len(batch) >= batch_size:
+                imported += Recipe.bulk_create(batch, current_user)
+                batch = []
+        
+        if batch:
+            imported += Recipe.bulk_create(batch, current_user)
+        
+        return {"imported": imported, "failed": failed,
+                "errors": errors}, HTTPStatus.OK
+    
 class RecipeResource(Resource):
     """
     This class holds the logic for the "/recipes/<recipe_id" endpoint
     """
+    @read_only
     @jwt_required(optional=True)
     def get(self, recipe_id):
-        recipe = Recipe.get_by_id(recipe_id)
-        if recipe is None:
-            return {"message": "recipe not found"}, HTTPStatus.NOT_FOUND
+        # the serialized recipe is cached along with what is needed to check
+        # the access and the conditional headers, so a cache hit does not
+        # touch the database or the serializer.
+        cache_key = 'recipe_detail:{}'.format(recipe_id)
+        tags = ['recipe:{}'.format(recipe_id)]
+        entry = get_tagged(cache_key)
+        
+        if entry is None:
+            # taken before the recipe is read so that a change made in
+            # between is not stored as current
+            snapshot = snapshot_tags(tags)
+            with fresh_reads(tags):
+                recipe = Recipe.get_by_id(recipe_id)
+                if recipe is None:
+                    return {"message": "recipe not found"}, \
+                        HTTPStatus.NOT_FOUND
+                
+                with metrics.timer('serializer_seconds',
+                                   schema='RecipeSchema'):
+                    data = dump_recipe(recipe)
+            # updated_at alone is not enough for the etag on databases that
+            # only keep seconds, so the payload is hashed along with it.
+            etag = hashlib.md5('{}:{}:{}'.format(
+                recipe.id, recipe.updated_at.isoformat(),
+                json.dumps(data, sort_keys=True)).encode()).hexdigest()
+            entry = {
+                'user_id': recipe.user_id,
+                'is_publish': recipe.is_publish,
+                'etag': etag,
+                'last_modified': recipe.updated_at,
+                'data': data
+            }
+            set_tagged(cache_key, entry, tags,
+                       timeout=current_app.config.get(
+                           'RECIPE_CACHE_TIMEOUT', 300), snapshot=snapshot)
         
         current_user = get_jwt_identity()
 
-        if current_user != recipe.user_id or recipe.is_publish == False:
+        if current_user != entry['user_id'] or entry['is_publish'] == False:
             return {"message": "Access not allowed"}, HTTPStatus.UNAUTHORIZED
         
-        return recipe_schema.dump(recipe), HTTPStatus.OK
+        headers = {
+            'ETag': quote_etag(entry['etag']),
+            'Last-Modified': http_date(entry['last_modified']),
+            'Cache-Control': 'private, no-cache'
+        }
+        
+        if not is_resource_modified(request.environ, etag=entry['etag'],
+                                    last_modified=entry['last_modified']):
+            return Response(status=HTTPStatus.NOT_MODIFIED, headers=headers)
+        
+        return entry['data'], HTTPStatus.OK, headers
     
     @jwt_required()
     def patch(self, recipe_id):
@@ -107,6 +293,8 @@ class RecipeResource(Resource):
         if current_user != recipe.user_id:
             return {"message": "Access not allowed"}, HTTPStatus.FORBIDDEN
         
+        changed = [field for field, value in data.items()
+                   if value and getattr(recipe, field) != value]
   
         recipe.name = data.get("name") or recipe.name
         recipe.description = data.get('description') or recipe.description
@@ -117,7 +305,7 @@ class RecipeResource(Resource):
         recipe.ingredients = data.get('ingredients') or recipe.ingredients
         
         recipe.save()
-        clear_cache('/recipes')
+        invalidate_recipe(recipe.id, changed)
         return recipe_schema.dump(recipe), HTTPStatus.OK
     
     @jwt_required()
@@ -132,6 +320,7 @@ class RecipeResource(Resource):
             return {"message": "Access not allowed"}, HTTPStatus.UNAUTHORIZED
         
         recipe.delete()
+        invalidate_recipe(recipe_id)
         
         return {}, HTTPStatus.NO_CONTENT
         
@@ -155,6 +344,7 @@ class RecipePublishResource(Resource):
         
         recipe.is_publish = True
         recipe.save()
+        invalidate_recipe(recipe.id)
         
         return {}, HTTPStatus.NO_CONTENT
     
@@ -171,6 +361,7 @@ class RecipePublishResource(Resource):
         
         recipe.is_publish = False
         recipe.save()
+        invalidate_recipe(recipe.id)
         return {}, HTTPStatus.NO_CONTENT
     
 class RecipeCoverUploadResource(Resource):
@@ -191,18 +382,26 @@ class RecipeCoverUploadResource(Resource):
         if not image_set.file_allowed(file, file.filename):
             return {"message": "file type not allowed"}, HTTPStatus.BAD_REQUEST
         
+        error = check_image(file)
+        if error:
+            return {"message": error}, HTTPStatus.BAD_REQUEST
+        
 
         
-        if recipe.cover_image:
-            cover_path = image_set.path(folder='covers',
-                                         filename=recipe.cover_image)
-            if os.path.exists(cover_path):
-                os.remove(cover_path)
-                
+        previous_cover = recipe.cover_image
         filename = save_image(file, 'covers')
         recipe.cover_image = filename
         recipe.save()
-        clear_cache('/recipes')
-        return recipe_cover_schema.dump(recipe), HTTPStatus.OK
+        # the previous files are removed once no recipe points to them
+        if previous_cover:
+            remove_image('covers', previous_cover, Recipe.cover_in_use)
+        invalidate_recipe(recipe.id, ['cover_image'])
+        # the uploaded file is served until the compressed one replaces it
+        process_image(filename, 'covers',
+                      partial(swap_cover, recipe.id, filename))
+        
+        data = recipe_cover_schema.dump(recipe)
+        data['status'] = 'pending'
+        return data, HTTPStatus.ACCEPTED
     
         
\ No newline at end of file
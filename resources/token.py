@@ -6,10 +6,9 @@ from flask_jwt_extended import (
 )
 from http import HTTPStatus
 
-from utils import verify_password
+from utils import verify_and_update_password
 from models.user import User
-
-blacklist = set()
+from extensions import jwt, revoked_tokens
 
 class TokenResource(Resource):
     """
@@ -20,11 +19,21 @@ class TokenResource(Resource):
         email = data.get('email')
         password = data.get('password')
         user = User.get_by_email(email)
+        valid, new_hash = False, None
+        
+        if user:
+            valid, new_hash = verify_and_update_password(
+                password, User.get_password(user.id))
         
-        if not user or not verify_password(password, user.password):
+        if not valid:
             return {
                 "message": "email or password is incorrect"
                 }, HTTPStatus.UNAUTHORIZED
+        
+        if new_hash:
+            # the hashing parameters changed since the password was hashed
+            user.password = new_hash
+            user.save()
 
         if user.is_active is False:
             return {'message': 'The user account is not activated yet'}, HTTPStatus.FORBIDDEN
@@ -59,7 +68,16 @@ class RevokeResource(Resource):
     """
     @jwt_required()
     def post(self):
-        jti = get_jwt()['jti']
-        blacklist.add(jti)
+        """
+        This endpoint revokes the access token of the request. It is
+        rejected by this worker at once, but the other workers may accept it
+        for up to TOKEN_REVOCATION_NEGATIVE_TTL (10) seconds when they found
+        it not revoked just before, see RevocationStore. Setting it to 0
+        makes the revocation immediate everywhere, at the cost of a lookup
+        of the token on every request.
+        """
+        jwt_data = get_jwt()
+        revoked_tokens.revoke(jwt_data['jti'], jwt_data.get('exp'))
+        jwt.forget_token(jwt_data['jti'])
         
         return {"message": "successfully logged out"}, HTTPStatus.OK
@@ -6,28 +6,38 @@ from http import HTTPStatus
 from marshmallow import ValidationError
 from dotenv import load_dotenv
 import os
+from functools import partial
 
 
 from webargs import fields
 from webargs.flaskparser import use_kwargs
 
+from schema.compiled import compile_schema
 from schema.user import UserSchema
 from schema.recipe import RecipeSchema, RecipePaginationSchema
 from models.user import User
 from models.recipe import Recipe
+from keyset import InvalidCursor
 from mailgun import MailgunApi
-from utils import generate_token, verify_token, save_image
-from extensions import image_set
+from utils import (
+    generate_token, verify_token, check_image, save_image, process_image,
+    swap_image, remove_image, encode_response, json_response)
+from extensions import image_set, mail_queue, metrics
+from routing import read_only
 
 user_schema = UserSchema()
-user_schema_public = UserSchema(exclude=('email',))
-user_schema_avatar = UserSchema(only=('avatar_image',))
+user_schema_public = UserSchema(exclude=('email', 'draft_recipe_count',
+                                         'recipe_count'))
+user_schema_avatar = UserSchema(only=('avatar_image', 'avatar_image_srcset'))
 # exclude=('email',) is used to prevent the email details from being passed
+# to other users, along with the number of drafts.
 recipe_list_schema = RecipeSchema(many=True)
 recipe_pagination_schema = RecipePaginationSchema()
+dump_recipe_page = compile_schema(recipe_pagination_schema)
 load_dotenv()
 
-mailgun = MailgunApi(os.getenv("MAILGUN_DOMAIN"),'MAILGUN_API_KEY')
+mailgun = MailgunApi(os.getenv("MAILGUN_DOMAIN"),'MAILGUN_API_KEY',
+                     api_url=os.getenv("MAILGUN_API_URL"))
 
 
 class UserListResource(Resource):
@@ -63,7 +73,10 @@ class UserListResource(Resource):
         link = url_for('useractivateresource',token=token,_external=True)
         text = "Hi! thanks for using smilecook, please confirm your registration by clicking on the link: {}".format(link)
         
-        mailgun.send_email(to=user.email, subject=subject, text=text,
+        # the email is sent by the mail queue so that the signup does not
+        # wait on the mail provider.
+        mail_queue.enqueue(mailgun.send_email, to=user.email, subject=subject,
+                    text=text,
                     html=render_template('confirmation.html', link=link))
         
         return user_schema.dump(user), HTTPStatus.CREATED
@@ -72,6 +85,7 @@ class UserResource(Resource):
     """
     This class holds the logic for the "/users/<string:username>" endpoint
     """
+    @read_only
     @jwt_required(optional=True)
     def get(self, username):
         """
@@ -113,6 +127,7 @@ class UserRecipeListResource(Resource):
     """
     #the @use_kwargs line of code is used to specify that we expect to 
     # receive query parameter visibility. 
+    @read_only
     @jwt_required(optional=True)
     @use_kwargs({
         'visibility': fields.String(missing='public'),
@@ -120,9 +135,11 @@ class UserRecipeListResource(Resource):
         'page': fields.Int(missing=1),
         'per_page': fields.Int(missing=10),
         'sort': fields.String(missing='created_at'),
-        'order': fields.String(missing='desc')
+        'order': fields.String(missing='desc'),
+        'cursor': fields.String(missing=None)
         }, location = "query")
-    def get(self, username, visibility, q, page, per_page, sort, order):
+    def get(self, username, visibility, q, page, per_page, sort, order,
+            cursor):
         user = User.get_by_username(username)
         
         if user == None:
@@ -134,14 +151,27 @@ class UserRecipeListResource(Resource):
         else:
             visibility = 'public'
             
-        if sort not in ['created_at', 'cook_time', 'num_of_servings']:
+        if sort not in ['created_at', 'cook_time', 'num_of_servings',
+                        'relevance']:
             sort = 'created_at'
         if order not in ['asc', 'desc']:
             order = 'desc'
             
-        recipe = Recipe.get_all_by_user(q, page, per_page, sort, order, user_id=user.id, visibility=visibility)
-        
-        return recipe_pagination_schema.dump(recipe), HTTPStatus.OK
+        try:
+            recipe = Recipe.get_all_by_user(q, page, per_page, sort, order,
+                                            user_id=user.id,
+                                            visibility=visibility,
+                                            cursor=cursor,
+                                            total=user.count_recipes(
+                                                visibility))
+        except InvalidCursor:
+            return {"message": "Invalid cursor"}, HTTPStatus.BAD_REQUEST
+        
+        with metrics.timer('serializer_seconds',
+                           schema='RecipePaginationSchema'):
+            data = dump_recipe_page(recipe)
+        
+        return json_response(encode_response(data))
     
 class UserActivateResource(Resource):
     """This class is used to activate the user account through the email 
@@ -167,6 +197,13 @@ class UserActivateResource(Resource):
         
         return {}, HTTPStatus.NO_CONTENT
     
+def swap_avatar(user_id, filename, compressed_filename):
+    """This function is called once an uploaded avatar has been compressed"""
+    swap_image(User.get_by_id(user_id), 'avatar_image', 'avatars', filename,
+               compressed_filename, User.avatar_in_use,
+               partial(swap_avatar, user_id, filename))
+
+
 class UserAvatarUploadResource(Resource):
     
     @jwt_required()
@@ -179,17 +216,24 @@ class UserAvatarUploadResource(Resource):
         if not image_set.file_allowed(file, file.filename):
             return {"message": "file type not allowed"}, HTTPStatus.BAD_REQUEST
         
+        error = check_image(file)
+        if error:
+            return {"message": error}, HTTPStatus.BAD_REQUEST
+        
         user = User.get_by_id(get_jwt_identity())
         
-        if user.avatar_image:
-            avatar_path = image_set.path(folder='avatars',
-                                         filename=user.avatar_image)
-            if os.path.exists(avatar_path):
-                os.remove(avatar_path)
-                
+        previous_avatar = user.avatar_image
         filename = save_image(file, 'avatars')
         user.avatar_image = filename
         user.save()
-            
-        return user_schema_avatar.dump(user), HTTPStatus.OK
+        # the previous files are removed once no user points to them
+        if previous_avatar:
+            remove_image('avatars', previous_avatar, User.avatar_in_use)
+        # the uploaded file is served until the compressed one replaces it
+        process_image(filename, 'avatars',
+                      partial(swap_avatar, user.id, filename))
+        
+        data = user_schema_avatar.dump(user)
+        data['status'] = 'pending'
+        return data, HTTPStatus.ACCEPTED
     
\ No newline at end of file
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+class DatabaseBackend:
+    """This backend keeps the revoked tokens in the revoked_token table"""
+
+    def __init__(self):
+        from models.revoked_token import RevokedToken
+        self.model = RevokedToken
+
+    def add(self, jti, expires):
+        expires_at = datetime.utcfromtimestamp(expires) if expires else None
+        # the expired tokens are dropped on each revocation so that the
+        # table only ever holds the tokens that could still be used.
+        self.model.purge_expired()
+        self.model(jti=jti, expires_at=expires_at).save()
+
+    def contains(self, jti):
+        return self.model.exists(jti)
+
+
+class CacheBackend:
+    """
+    This backend keeps the revoked tokens in the app cache, which is shared
+    between the workers when it is Redis or memcached. Each entry expires
+    along with its token.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def add(self, jti, expires):
+        timeout = max(int(expires - time.time()), 1) if expires else 0
+        self.cache.set('revoked:{}'.format(jti), True, timeout=timeout)
+
+    def contains(self, jti):
+        return self.cache.get('revoked:{}'.format(jti)) is not None
+
+
+class RevocationStore:
+    """
+    This class keeps track of the revoked tokens. The tokens are stored by a
+    shared backend chosen with TOKEN_REVOCATION_BACKEND ('database' or
+    'cache') and the revoked ones are also remembered in a bounded local LRU
+    (TOKEN_REVOCATION_LRU_SIZE entries), so a token that keeps being sent
+    after a logout does not reach the backend again.
+
+    The tokens found not to be revoked are remembered for
+    TOKEN_REVOCATION_NEGATIVE_TTL seconds (10), so a client sending the same
+    token again does not reach the backend either. The cost is that a token
+    revoked through "/revoke" on one worker is still accepted for up to that
+    long by the other workers that checked it just before. A revocation done
+    by the same worker is seen at once. 0 disables it and makes the
+    revocations immediate everywhere.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.lock = threading.Lock()
+        self.revoked = OrderedDict()
+        self.not_revoked = OrderedDict()
+        self.lru_size = 10000
+        self.negative_ttl = 10
+
+    def init_app(self, app, cache):
+        self.lru_size = app.config.get('TOKEN_REVOCATION_LRU_SIZE',
+                                       self.lru_size)
+        self.negative_ttl = app.config.get('TOKEN_REVOCATION_NEGATIVE_TTL',
+                                           self.negative_ttl)
+
+        if app.config.get('TOKEN_REVOCATION_BACKEND', 'database') == 'cache':
+            self.backend = CacheBackend(cache)
+        else:
+            self.backend = DatabaseBackend()
+
+    def remember(self, entries, jti, until):
+        with self.lock:
+            entries[jti] = until
+            entries.move_to_end(jti)
+            while len(entries) > self.lru_size:
+                entries.popitem(last=False)
+
+    def recall(self, entries, jti):
+        with self.lock:
+            until = entries.get(jti)
+            if until is None:
+                return False
+            if until and until < time.time():
+                del entries[jti]
+                return False
+            entries.move_to_end(jti)
+            return True
+
+    def revoke(self, jti, expires=None):
+        """
+        This method revokes a token, expires is its exp claim. The token is
+        forgotten once expired since it is rejected as such from then on.
+        """
+        self.backend.add(jti, expires)
+        with self.lock:
+            self.not_revoked.pop(jti, None)
+        self.remember(self.revoked, jti, expires or 0)
+
+    def is_revoked(self, jti, expires=None):
+        if self.recall(self.revoked, jti):
+            return True
+        if self.negative_ttl and self.recall(self.not_revoked, jti):
+            return False
+
+        if self.backend.contains(jti):
+            self.remember(self.revoked, jti, expires or 0)
+            return True
+
+        if self.negative_ttl:
+            self.remember(self.not_revoked, jti,
+                          time.time() + self.negative_ttl)
+        return False
@@ -0,0 +1,208 @@
+import os
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+from ratelimit import get_identity
+
+# the caches that are not shared between the workers
+LOCAL_CACHES = ('null', 'nullcache', 'simple', 'simplecache')
+
+# the pool of each worker process, unless DATABASE_POOL_* is set. It holds a
+# connection for each thread of the worker (GUNICORN_THREADS, 32 as in
+# gunicorn.conf.py), the overflow is for the background threads refreshing
+# the cache or swapping the images. See gunicorn.conf.py for the total.
+POOL_MAX_OVERFLOW = 4
+POOL_TIMEOUT = 10
+POOL_RECYCLE = 1800
+
+
+def pool_size():
+    return int(os.getenv('GUNICORN_THREADS', 32))
+
+
+def engine_options(url, config):
+    """
+    This function returns the pool options of an engine. SQLite is left
+    with the pool SQLAlchemy picks for it since it is a local file.
+    """
+    if str(url).startswith('sqlite'):
+        return {}
+
+    return {
+        'pool_size': config.get('DATABASE_POOL_SIZE', pool_size()),
+        'max_overflow': config.get('DATABASE_MAX_OVERFLOW', POOL_MAX_OVERFLOW),
+        'pool_timeout': config.get('DATABASE_POOL_TIMEOUT', POOL_TIMEOUT),
+        'pool_recycle': config.get('DATABASE_POOL_RECYCLE', POOL_RECYCLE),
+        # a connection dropped by the server is replaced before it is used
+        'pool_pre_ping': True,
+    }
+
+
+def configure_database(app):
+    """
+    This function sets the pool options of the engines and adds the
+    'replica' bind when SQLALCHEMY_REPLICA_URI is set, it has to be called
+    before db.init_app. The callers that wrote are remembered in the cache,
+    so the replica is only used when the cache is shared by the workers.
+    """
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    for key, value in engine_options(
+            app.config.get('SQLALCHEMY_DATABASE_URI', ''), app.config).items():
+        options.setdefault(key, value)
+
+    replica_uri = app.config.get('SQLALCHEMY_REPLICA_URI')
+    cache_type = str(app.config.get('CACHE_TYPE', 'null'))
+    if replica_uri and cache_type.rsplit('.', 1)[-1].lower() in LOCAL_CACHES:
+        app.logger.warning('The replica is not used with the %s cache, the '
+                           'workers could not read their writes', cache_type)
+    elif replica_uri:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault('replica', dict(
+            engine_options(replica_uri, app.config), url=replica_uri))
+
+
+def replica_enabled():
+    return 'replica' in current_app.config.get('SQLALCHEMY_BINDS', {})
+
+
+def sticky_key(identity):
+    return 'primary:user:{}'.format(identity)
+
+
+def wrote_recently():
+    """
+    This function tells if the caller wrote to the primary in the last
+    REPLICA_STICKY_SECONDS, in which case the replica may not have the
+    changes yet. The anonymous callers cannot write. The identity is the one
+    the limiter already resolved for the request.
+    """
+    from extensions import cache
+
+    identity = get_identity()
+    if identity is None:
+        return False
+
+    return cache.get(sticky_key(identity)) is not None
+
+
+def read_only(func):
+    """
+    This decorator sends the queries of a resource method to the replica,
+    unless the caller wrote recently. It does nothing without a replica.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if replica_enabled():
+            g.read_only = not wrote_recently()
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def primary():
+    """This context manager sends the queries made within it to the primary"""
+    read_only = g.get('read_only')
+    g.read_only = False
+    try:
+        yield
+    finally:
+        g.read_only = read_only
+
+
+def remember_invalidation(tags):
+    """
+    This function remembers the cache tags invalidated by a write for
+    REPLICA_STICKY_SECONDS, the replica may not have the write until then.
+    """
+    if not replica_enabled():
+        return
+
+    from extensions import cache
+
+    cache.set_many({'invalidated:{}'.format(tag): True for tag in tags},
+                   timeout=current_app.config.get('REPLICA_STICKY_SECONDS',
+                                                  10))
+
+
+def recently_invalidated(tags):
+    """This function tells if one of the tags was invalidated lately"""
+    if not tags or not g.get('read_only'):
+        return False
+
+    from extensions import cache
+
+    return any(value is not None for value in cache.get_many(
+        *['invalidated:{}'.format(tag) for tag in tags]))
+
+
+@contextmanager
+def fresh_reads(tags):
+    """
+    This context manager sends the queries made within it to the primary
+    when one of the cache tags was invalidated lately, the value they
+    compute is cached for every caller and the replica may be behind.
+    """
+    if recently_invalidated(tags):
+        with primary():
+            yield
+    else:
+        yield
+
+
+class RoutingSession(Session):
+    """
+    This class sends the queries of the read only requests to the 'replica'
+    bind and everything else to the primary. A session that writes uses the
+    primary from then on, and the caller keeps reading from the primary for
+    REPLICA_STICKY_SECONDS (10) after the commit so that it reads its own
+    writes, which the workers share through the cache.
+
+    The values cached for every caller are computed on the primary when
+    one of their tags was invalidated in the last REPLICA_STICKY_SECONDS
+    (see fresh_reads), a replica behind it would have them stored as
+    current under the tag versions bumped by the write.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        elif bind is None and not self.info.get('wrote') \
+                and has_app_context() and g.get('read_only'):
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def remember_writer(session):
+    if not session.info.pop('wrote', False) or not has_request_context():
+        return
+
+    from extensions import cache
+
+    # the rest of the request reads what it wrote
+    g.read_only = False
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        # the endpoint does not take a token
+        return
+
+    if identity is not None:
+        cache.set(sticky_key(identity), True, timeout=current_app.config.get(
+            'REPLICA_STICKY_SECONDS', 10))
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_writes(session):
+    session.info.pop('wrote', None)
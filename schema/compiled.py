@@ -0,0 +1,119 @@
+from marshmallow import fields, missing
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+
+# the fields dumped inline, with the expression that formats a value that
+# is not None. Their subclasses may format values differently so only the
+# exact types are listed, along with Email that formats like String. Boolean
+# is left out since it maps its truthy and falsy values first.
+SIMPLE_FIELDS = {
+    fields.Integer: 'int(value)',
+    fields.String: 'str(value)',
+    fields.Email: 'str(value)',
+    fields.DateTime: 'value.isoformat()',
+}
+
+
+def simple_expression(field):
+    expression = SIMPLE_FIELDS.get(type(field))
+    if expression is None or field.dump_default is not missing:
+        return None
+    if isinstance(field, fields.Integer) and field.as_string:
+        return None
+    if isinstance(field, fields.DateTime) and field.format not in (None,
+                                                                   'iso'):
+        return None
+
+    return expression
+
+
+def has_dump_hooks(schema):
+    """
+    This function tells if a schema has pre_dump or post_dump hooks. The
+    hooks are keyed by (tag, pass_many) up to marshmallow 3.21 and by tag
+    since, a schema whose hooks cannot be read is taken as having some.
+    """
+    hooks = getattr(schema, '_hooks', None)
+    if not isinstance(hooks, dict):
+        return True
+
+    for key, names in hooks.items():
+        tag = key[0] if isinstance(key, tuple) else key
+        if tag in (PRE_DUMP, POST_DUMP) and names:
+            return True
+
+    return False
+
+
+def compile_schema(schema):
+    """
+    This function returns a function that dumps an object like
+    schema.dump(obj) does, with the fields unrolled into the generated code
+    of a single function instead of going through field.serialize for each
+    field of each item. Nested schemas are compiled as well, and the fields
+    that are not simple ones fall back to field.serialize.
+
+    The objects are read with getattr, so the compiled function is meant for
+    models, and schemas with pre_dump or post_dump hooks are dumped by
+    marshmallow.
+    """
+    if has_dump_hooks(schema):
+        return schema.dump
+
+    namespace = {'missing': missing, 'get_attribute': schema.get_attribute}
+    lines = ['def dump_one(obj):', '    ret = {}']
+
+    for index, (attr_name, field) in enumerate(schema.dump_fields.items()):
+        key = field.data_key if field.data_key is not None else attr_name
+        attribute = field.attribute or attr_name
+        expression = simple_expression(field)
+
+        if expression and '.' not in attribute:
+            lines += [
+                '    value = getattr(obj, {!r}, missing)'.format(attribute),
+                '    if value is not missing:',
+                '        ret[{!r}] = None if value is None else {}'.format(
+                    key, expression),
+            ]
+        elif type(field) is fields.Method:
+            # a Method field without a serialize method is never dumped
+            if field.serialize_method_name:
+                name = 'method_{}'.format(index)
+                namespace[name] = getattr(schema, field.serialize_method_name)
+                lines.append('    ret[{!r}] = {}(obj)'.format(key, name))
+        elif type(field) is fields.Nested and '.' not in attribute \
+                and field.dump_default is missing:
+            name = 'nested_{}'.format(index)
+            nested = field.schema
+            # like the Nested field, a nested schema made with many=True
+            # dumps a list
+            if nested.many or not field.many:
+                namespace[name] = compile_schema(nested)
+            else:
+                dump_nested = compile_schema(nested)
+                namespace[name] = lambda objs: [dump_nested(obj)
+                                                for obj in objs]
+            lines += [
+                '    value = getattr(obj, {!r}, missing)'.format(attribute),
+                '    if value is not missing:',
+                '        ret[{!r}] = None if value is None else {}(value)'
+                .format(key, name),
+            ]
+        else:
+            name = 'field_{}'.format(index)
+            namespace[name] = field
+            lines += [
+                '    value = {}.serialize({!r}, obj, accessor=get_attribute)'
+                .format(name, attr_name),
+                '    if value is not missing:',
+                '        ret[{!r}] = value'.format(key),
+            ]
+
+    lines.append('    return ret')
+    exec(compile('\n'.join(lines), '<compiled {}>'.format(
+        type(schema).__name__), 'exec'), namespace)
+    dump_one = namespace['dump_one']
+
+    if schema.many:
+        return lambda objs: [dump_one(obj) for obj in objs]
+
+    return dump_one
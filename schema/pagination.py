@@ -2,6 +2,8 @@ from flask import request
 from marshmallow import Schema, fields
 from urllib.parse import urlencode
 
+from keyset import KeysetPagination
+
 class PaginationSchema(Schema):
     
     class Meta: 
@@ -19,8 +21,19 @@ class PaginationSchema(Schema):
             query_args['page'] = page
         
             return "{}?{}".format(request.base_url, urlencode(query_args))
+    
+    @staticmethod
+    def get_cursor_url(cursor):
+        query_args = request.args.to_dict()
+        query_args.pop('page', None)
+        query_args['cursor'] = cursor
+        
+        return "{}?{}".format(request.base_url, urlencode(query_args))
         
     def get_pagination_links(self, paginated_objects):
+        if isinstance(paginated_objects, KeysetPagination):
+            return self.get_cursor_links(paginated_objects)
+        
         pagination_links = {
             'first': self.get_url(page=1),
             'last': self.get_url(page=paginated_objects.pages)
@@ -36,4 +49,16 @@ class PaginationSchema(Schema):
           
         return pagination_links
     
-    
\ No newline at end of file
+    def get_cursor_links(self, paginated_objects):
+        # there is no last page when paging with cursors, only the next and
+        # previous positions in the list.
+        pagination_links = {'first': self.get_cursor_url(cursor='')}
+        
+        if paginated_objects.next_cursor:
+            pagination_links['next'] = self.get_cursor_url(
+                                            paginated_objects.next_cursor)
+        if paginated_objects.prev_cursor:
+            pagination_links['prev'] = self.get_cursor_url(
+                                            paginated_objects.prev_cursor)
+            
+        return pagination_links
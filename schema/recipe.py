@@ -1,10 +1,8 @@
-from flask import url_for
-
-
 from marshmallow import (
     Schema, fields, validate, validates, ValidationError, post_dump
     )
 from schema.user import UserSchema
+from utils import image_srcset, image_url
 from schema.pagination import PaginationSchema
 
 # the schema class are used for serialization and deserialization
@@ -36,6 +34,7 @@ class RecipeSchema(Schema):
     num_of_servings = fields.Method(validate=validate_number_of_servings)
     cook_time = fields.Integer()
     cover_image = fields.Method(serialize='dump_cover_url')
+    cover_image_srcset = fields.Method(serialize='dump_cover_srcset')
     ingredients = fields.String(required=True,
                                 validate=[validate.Length(max=1000)])
     
@@ -54,13 +53,15 @@ class RecipeSchema(Schema):
     
     def dump_cover_url(self, recipe):
         if recipe.cover_image:
-            return url_for('static', 
-                filename='images/covers/{}'.format(recipe.cover_image),
-                _external = True)
+            return image_url('covers', recipe.cover_image)
+        else:
+            return image_url('assets', 'default-cover.jpg')
+    
+    def dump_cover_srcset(self, recipe):
+        if recipe.cover_image:
+            return image_srcset('covers', recipe.cover_image)
         else:
-            return url_for('static', 
-                           filename='images/assets/default-cover.jpg',
-                           _external = True)
+            return image_srcset('assets', 'default-cover.jpg')
             
 class RecipePaginationSchema(PaginationSchema):
     # This class inherits all the fields and properties of the PaginationSchema
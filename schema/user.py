@@ -1,6 +1,5 @@
 from marshmallow import Schema, fields
-from utils import hash_password
-from flask import url_for
+from utils import hash_password, image_srcset, image_url
 
 class UserSchema(Schema):
     class Meta: ordered = True
@@ -12,16 +11,22 @@ class UserSchema(Schema):
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
     avatar_image = fields.Method(serialize='dump_avatar_url')
+    avatar_image_srcset = fields.Method(serialize='dump_avatar_srcset')
+    published_recipe_count = fields.Integer(dump_only=True)
+    draft_recipe_count = fields.Integer(dump_only=True)
+    recipe_count = fields.Integer(dump_only=True)
     
     def load_password(self, value):
         return hash_password(value)
     
     def dump_avatar_url(self, user):
         if user.avatar_image:
-            return url_for('static', 
-                filename='images/avatars/{}'.format(user.avatar_image),
-                _external = True)
+            return image_url('avatars', user.avatar_image)
         else:
-            return url_for('static', 
-                           filename='images/assets/default-avatar.jpg',
-                           _external = True)
\ No newline at end of file
+            return image_url('assets', 'default-avatar.jpg')
+    
+    def dump_avatar_srcset(self, user):
+        if user.avatar_image:
+            return image_srcset('avatars', user.avatar_image)
+        else:
+            return image_srcset('assets', 'default-avatar.jpg')
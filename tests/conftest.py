@@ -0,0 +1,62 @@
+import pytest
+
+from app import create_app
+from config import Config
+from extensions import db
+from hashing import hash_with_rounds
+from models.recipe import Recipe
+from models.user import User
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        SQLALCHEMY_BINDS = {}
+        SQLALCHEMY_REPLICA_URI = None
+        UPLOADED_IMAGES_DEST = str(tmp_path / 'images')
+        CACHE_TYPE = 'SimpleCache'
+        RATELIMIT_ENABLED = False
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        # the binds of the other apps, like the replica, are left out
+        db.create_all(bind_key=None)
+        yield app
+        db.session.remove()
+        db.drop_all(bind_key=None)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username, password='password'):
+        user = User(username=username, email='{}@example.com'.format(username),
+                    password=hash_with_rounds(password, 1000), is_active=True)
+        user.save()
+        return user
+
+    return make_user
+
+
+@pytest.fixture
+def make_recipes(app):
+    def make_recipes(user, count, is_publish=True, **fields):
+        recipes = []
+        for i in range(count):
+            values = dict(name='Recipe {}'.format(i), description='A dish',
+                          directions='Mix everything.', ingredients='egg',
+                          cook_time=10 + i, num_of_servings=2,
+                          is_publish=is_publish, user_id=user.id)
+            values.update(fields)
+            recipe = Recipe(**values)
+            recipe.save()
+            recipes.append(recipe)
+        return recipes
+
+    return make_recipes
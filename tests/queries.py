@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from extensions import db
+
+
+@contextmanager
+def count_queries():
+    """
+    This context manager records the SQL statements run inside its block on
+    every engine of the app. It is meant to be used with an app context, to
+    check that a code path does not regress into one query per item:
+
+        with count_queries() as statements:
+            client.get('/recipes')
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        statements.append(statement)
+
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(max_queries):
+    """
+    This context manager raises an AssertionError when more than max_queries
+    SQL statements are run inside its block.
+    """
+    with count_queries() as statements:
+        yield statements
+
+    if len(statements) > max_queries:
+        raise AssertionError('{} queries were run, expected at most {}:\n{}'
+                             .format(len(statements), max_queries,
+                                     '\n'.join(statements)))
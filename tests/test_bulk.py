@@ -0,0 +1,69 @@
+import io
+import json
+
+from flask import request
+from flask_jwt_extended import create_access_token
+
+from app import Request
+from models.recipe import Recipe
+
+
+def ndjson(count):
+    return ''.join(json.dumps({
+        'name': 'Recipe {}'.format(i), 'description': 'A dish',
+        'directions': 'Mix everything.', 'ingredients': 'egg',
+        'cook_time': 10, 'num_of_servings': 2}) + '\n' for i in range(count))
+
+
+def headers_of(user):
+    return {'Authorization': 'Bearer {}'.format(
+        create_access_token(identity=user.id)),
+        'Content-Type': 'application/x-ndjson'}
+
+
+def test_bulk_import_is_not_held_to_the_upload_limit(app, client,
+                                                     make_user):
+    app.config['MAX_CONTENT_LENGTH'] = 1024
+    headers = headers_of(make_user('alice'))
+    body = ndjson(100)
+    assert len(body) > 1024
+
+    response = client.post('/recipes/bulk', data=body, headers=headers)
+
+    assert response.status_code == 200
+    assert response.get_json()['imported'] == 100
+    assert Recipe.query.count() == 100
+
+    # the other endpoints keep the limit
+    recipe = Recipe.query.first()
+    response = client.put(
+        '/recipes/{}/cover'.format(recipe.id),
+        headers={'Authorization': headers['Authorization']},
+        content_type='multipart/form-data',
+        data={'cover': (io.BytesIO(b'x' * 2048), 'cover.jpg')})
+    assert response.status_code == 413
+
+
+def test_bulk_import_has_a_cap_of_its_own(app, client, make_user):
+    app.config['BULK_IMPORT_MAX_SIZE'] = 1024
+
+    response = client.post('/recipes/bulk', data=ndjson(100),
+                           headers=headers_of(make_user('alice')))
+
+    assert response.status_code == 413
+    assert Recipe.query.count() == 0
+
+
+def test_request_class_keeps_the_limit_of_each_resource(app):
+    app.config['BULK_IMPORT_MAX_SIZE'] = 2048
+
+    # a class attribute, like the one of patch_request_class, would hide it
+    assert isinstance(vars(Request)['max_content_length'], property)
+    assert issubclass(app.request_class, Request)
+    assert app.request_class.max_content_length is \
+        vars(Request)['max_content_length']
+
+    with app.test_request_context('/recipes/bulk', method='POST'):
+        assert request.max_content_length == 2048
+    with app.test_request_context('/recipes/1/cover', method='PUT'):
+        assert request.max_content_length == 10 * 1024 * 1024
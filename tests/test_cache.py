@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from extensions import cache
+from models.recipe import Recipe
+from resources.recipe import invalidate_recipe
+from utils import (
+    get_key_lock, get_or_compute, invalidate_tags, lookup_tagged)
+
+
+def in_threads(app, count, func):
+    """This function calls func in count threads at once, in a request"""
+    results = []
+    start = threading.Barrier(count)
+
+    def run():
+        with app.test_request_context('/recipes'):
+            start.wait()
+            results.append(func())
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    return results
+
+
+def test_invalidation_during_compute_is_not_lost(app):
+    def compute():
+        # a write lands while the page is computed from the old rows
+        invalidate_tags('recipes')
+        return 'old page', ['recipes']
+
+    with app.test_request_context('/recipes'):
+        assert get_or_compute('view:page', compute, timeout=60,
+                              tags=['recipes']) == 'old page'
+        assert lookup_tagged('view:page')[1] == 'stale'
+
+
+def test_invalidation_of_a_late_tag_during_compute_is_not_lost(app):
+    def compute():
+        # the recipe tags are only known once the page is computed
+        invalidate_tags('recipe:1')
+        return 'old page', ['recipes', 'recipe:1']
+
+    with app.test_request_context('/recipes'):
+        assert get_or_compute('view:page', compute, timeout=60,
+                              tags=['recipes']) == 'old page'
+        assert lookup_tagged('view:page')[1] == 'miss'
+
+
+def test_value_is_served_until_its_tags_are_invalidated(app):
+    def compute():
+        return 'page', ['recipes', 'recipe:1']
+
+    with app.test_request_context('/recipes'):
+        get_or_compute('view:page', compute, timeout=60, tags=['recipes'])
+        assert lookup_tagged('view:page') == ('page', 'hit')
+
+        invalidate_tags('recipe:1')
+        assert lookup_tagged('view:page')[1] == 'stale'
+
+
+def test_recipe_detail_is_not_cached_across_a_concurrent_patch(
+        app, client, make_user, make_recipes, monkeypatch):
+    user = make_user('alice')
+    recipe = make_recipes(user, 1)[0]
+    headers = {'Authorization': 'Bearer {}'.format(
+        create_access_token(identity=user.id))}
+    get_by_id = Recipe.get_by_id
+
+    def racing_get_by_id(recipe_id):
+        found = get_by_id(recipe_id)
+        # the PATCH commits and invalidates once the recipe was read
+        invalidate_recipe(recipe_id, ['name'])
+        return found
+
+    monkeypatch.setattr(Recipe, 'get_by_id', racing_get_by_id)
+    assert client.get('/recipes/{}'.format(recipe.id),
+                      headers=headers).status_code == 200
+    monkeypatch.undo()
+
+    assert lookup_tagged('recipe_detail:{}'.format(recipe.id))[1] == 'stale'
+
+
+def test_concurrent_misses_compute_once(app):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'page', ['recipes']
+
+    results = in_threads(app, 8, lambda: get_or_compute(
+        'view:page', compute, timeout=60, tags=['recipes']))
+
+    assert results == ['page'] * 8
+    assert len(calls) == 1
+
+
+def test_expired_value_is_served_while_one_refresh_runs(app):
+    with app.test_request_context('/recipes'):
+        get_or_compute('view:page', lambda: ('old page', ['recipes']),
+                       timeout=1, stale_timeout=60, tags=['recipes'])
+    time.sleep(1.1)
+
+    calls = []
+    refreshing = threading.Event()
+
+    def compute():
+        calls.append(1)
+        refreshing.wait(timeout=30)
+        return 'new page', ['recipes']
+
+    results = in_threads(app, 8, lambda: get_or_compute(
+        'view:page', compute, timeout=60, stale_timeout=60,
+        tags=['recipes']))
+    assert results == ['old page'] * 8
+
+    refreshing.set()
+    deadline = time.time() + 30
+    with app.test_request_context('/recipes'):
+        while lookup_tagged('view:page', record=False)[0] != 'new page' \
+                and time.time() < deadline:
+            time.sleep(0.05)
+        assert lookup_tagged('view:page', record=False) == ('new page',
+                                                           'hit')
+    assert len(calls) == 1
+
+
+def test_locks_are_released_when_compute_fails(app):
+    def compute():
+        raise RuntimeError('the database is down')
+
+    with app.test_request_context('/recipes'):
+        with pytest.raises(RuntimeError):
+            get_or_compute('view:page', compute, timeout=60)
+
+        assert cache.get('lock:view:page') is None
+        key_lock = get_key_lock('view:page')
+        assert key_lock.lock.acquire(blocking=False)
+        key_lock.lock.release()
+        assert get_or_compute('view:page', lambda: ('page', []),
+                              timeout=60) == 'page'
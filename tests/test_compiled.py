@@ -0,0 +1,40 @@
+from marshmallow import Schema, fields, post_dump
+
+from models.recipe import Recipe
+from resources.recipe import (
+    dump_recipe, dump_recipe_page, recipe_pagination_schema, recipe_schema)
+from schema.compiled import compile_schema, has_dump_hooks
+
+
+def test_compiled_dumps_match_marshmallow(app, make_user, make_recipes):
+    user = make_user('alice')
+    make_recipes(user, 3)
+    make_recipes(user, 2, cook_time=None, description=None,
+                 cover_image='0123456789abcdef0123456789abcdef_cover.jpg')
+
+    with app.test_request_context('/recipes?per_page=4'):
+        page = Recipe.get_all_published('', 1, 4, 'created_at', 'desc')
+        assert dump_recipe_page(page) == recipe_pagination_schema.dump(page)
+        for recipe in page.items:
+            assert dump_recipe(recipe) == recipe_schema.dump(recipe)
+
+        cursor_page = Recipe.get_all_published('', 1, 4, 'cook_time', 'asc',
+                                               cursor='')
+        assert dump_recipe_page(cursor_page) == \
+            recipe_pagination_schema.dump(cursor_page)
+
+
+def test_schemas_with_dump_hooks_are_dumped_by_marshmallow():
+    class PlainSchema(Schema):
+        name = fields.String()
+
+    class HookedSchema(PlainSchema):
+        @post_dump
+        def wrap(self, data, **kwargs):
+            return {'wrapped': data}
+
+    assert not has_dump_hooks(PlainSchema())
+    assert has_dump_hooks(HookedSchema())
+
+    hooked = HookedSchema()
+    assert compile_schema(hooked) == hooked.dump
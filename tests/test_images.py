@@ -0,0 +1,60 @@
+import os
+import time
+
+from PIL import Image
+
+from extensions import db, image_pool, image_set
+from models.recipe import Recipe
+from resources.recipe import swap_cover
+from utils import compress_image, image_missing, remove_image, swap_image
+
+
+def upload(folder, filename):
+    path = image_set.path(folder=folder, filename=filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new('RGB', (64, 48), 'orange').save(path, 'JPEG')
+
+    return path
+
+
+def uploaded(folder, filename):
+    return os.path.exists(image_set.path(folder=folder, filename=filename))
+
+
+def test_swap_waits_for_the_files_removed_in_the_meantime(
+        make_user, make_recipes):
+    recipe_id = make_recipes(make_user('alice'), 1,
+                             cover_image='upload.jpg')[0].id
+    compressed_filename = compress_image(upload('covers', 'upload.jpg'))
+
+    # another recipe with the same image dropped it before the swap
+    remove_image('covers', compressed_filename, Recipe.cover_in_use)
+    assert image_missing('covers', compressed_filename)
+
+    try:
+        swap_cover(recipe_id, 'upload.jpg', compressed_filename)
+        # the upload is served until the files are written again in the pool
+        assert Recipe.get_by_id(recipe_id).cover_image == 'upload.jpg'
+
+        deadline = time.time() + 30
+        while uploaded('covers', 'upload.jpg') and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        image_pool.shutdown()
+
+    db.session.expire_all()
+    assert Recipe.get_by_id(recipe_id).cover_image == compressed_filename
+    assert not image_missing('covers', compressed_filename)
+    assert not uploaded('covers', 'upload.jpg')
+
+
+def test_upload_is_removed_once_the_files_are_written_again(
+        make_user, make_recipes):
+    compressed_filename = compress_image(upload('covers', 'upload.jpg'))
+    recipe = make_recipes(make_user('alice'), 1,
+                          cover_image=compressed_filename)[0]
+
+    assert not swap_image(recipe, 'cover_image', 'covers', 'upload.jpg',
+                          compressed_filename, Recipe.cover_in_use)
+    assert not uploaded('covers', 'upload.jpg')
+    assert not image_missing('covers', compressed_filename)
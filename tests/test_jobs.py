@@ -0,0 +1,78 @@
+import os
+import signal
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+import requests
+
+from jobs import JobQueue, ProcessPool
+from mailgun import MailgunApi, is_transient
+
+
+class Transport:
+    """This class answers every message with the next status, or raises it"""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        status = self.statuses.pop(0) if len(self.statuses) > 1 \
+            else self.statuses[0]
+        if isinstance(status, Exception):
+            raise status
+        response = requests.Response()
+        response.status_code = status
+        response.url = url
+        return response
+
+
+def send(transport):
+    queue = JobQueue('TEST_QUEUE', retry_if=is_transient)
+    queue.retries = 3
+    queue.backoff = 0
+    mailgun = MailgunApi('example.com', 'key', transport=transport)
+    queue.run(mailgun.send_email, (), {'to': 'alice@example.com',
+                                       'subject': 'Hi', 'text': 'Hello'})
+
+
+@pytest.mark.parametrize('status', [400, 401, 404])
+def test_client_errors_are_not_retried(status):
+    transport = Transport(status)
+    send(transport)
+
+    assert transport.calls == 1
+
+
+@pytest.mark.parametrize('status', [
+    429, 500, 503, requests.ConnectionError(), requests.Timeout()])
+def test_transient_errors_are_retried(status):
+    transport = Transport(status)
+    send(transport)
+
+    assert transport.calls == 4
+
+
+def test_message_is_sent_once_the_api_recovers():
+    transport = Transport(503, requests.ConnectionError(), 200)
+    send(transport)
+
+    assert transport.calls == 3
+
+
+def test_process_pool_is_replaced_once_broken():
+    pool = ProcessPool('TEST_POOL')
+    pool.num_workers = 1
+    try:
+        pid = pool.submit(os.getpid).result()
+        running = pool.submit(time.sleep, 60)
+        os.kill(pid, signal.SIGKILL)
+        with pytest.raises(BrokenProcessPool):
+            running.result(timeout=30)
+
+        assert pool.submit(pow, 2, 3).result(timeout=30) == 8
+        assert pool.submit(os.getpid).result(timeout=30) != pid
+    finally:
+        pool.shutdown()
@@ -0,0 +1,102 @@
+import json
+from base64 import urlsafe_b64encode
+
+import pytest
+from sqlalchemy import event
+
+from extensions import db
+
+
+def walk(client, url, link='next'):
+    """This function follows the cursor links from url and returns the pages"""
+    pages = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append([recipe['id'] for recipe in response.get_json()['data']])
+        url = response.get_json()['links'].get(link)
+
+    return pages
+
+
+def test_cursor_follows_relevance_sorted_search(client, make_user,
+                                                make_recipes):
+    user = make_user('alice')
+    make_recipes(user, 4, name='Egg fried rice', ingredients='egg')
+    make_recipes(user, 4, name='Rice', ingredients='egg')
+    make_recipes(user, 3, name='Rice', ingredients='salt')
+
+    everything = walk(client, '/recipes?q=egg&sort=relevance&per_page=20')
+    pages = walk(client, '/recipes?q=egg&sort=relevance&per_page=3&cursor=')
+
+    assert len(everything[0]) == 8
+    assert [id for page in pages for id in page] == everything[0]
+
+
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_cursor_pages_through_null_sort_values(client, make_user,
+                                               make_recipes, order):
+    user = make_user('alice')
+    make_recipes(user, 4, cook_time=None)
+    make_recipes(user, 5)
+    make_recipes(user, 3, cook_time=None)
+
+    everything = walk(client, '/recipes?sort=cook_time&order={}'
+                      '&per_page=20'.format(order))
+    pages = walk(client, '/recipes?sort=cook_time&order={}&per_page=3'
+                 '&cursor='.format(order))
+    ids = [id for page in pages for id in page]
+
+    assert len(ids) == 12
+    assert ids == everything[0]
+
+    # and back from the last page
+    last = client.get('/recipes?sort=cook_time&order={}&per_page=3&cursor='
+                      .format(order))
+    for _ in range(len(pages) - 1):
+        last = client.get(last.get_json()['links']['next'])
+    back = walk(client, last.get_json()['links']['prev'], link='prev')
+    assert back == pages[-2::-1]
+
+
+def test_cursor_pages_seek_in_the_sort_index(app, client, make_user,
+                                             make_recipes):
+    user = make_user('alice')
+    make_recipes(user, 6, cook_time=None)
+    make_recipes(user, 6)
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        if statement.startswith('SELECT recipe.id'):
+            statements.append((statement, parameters))
+
+    first = client.get('/recipes?sort=cook_time&per_page=4&cursor=')
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        walk(client, first.get_json()['links']['next'])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+
+    assert statements
+    connection = db.session.connection()
+    for statement, parameters in statements:
+        plan = ' '.join(row[3] for row in connection.exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + statement, parameters))
+        assert 'ix_recipe_publish_cook_time' in plan
+        assert 'TEMP B-TREE' not in plan
+
+
+@pytest.mark.parametrize('value', [[1, 2], {'a': 1}])
+def test_cursor_with_a_tampered_value_is_rejected(client, make_user,
+                                                  make_recipes, value):
+    make_recipes(make_user('alice'), 2)
+    cursor = urlsafe_b64encode(json.dumps(['next', value, 1]).encode())
+
+    response = client.get('/recipes?sort=cook_time&cursor={}'.format(
+        cursor.decode()))
+
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'Invalid cursor'}
@@ -0,0 +1,32 @@
+import os
+
+from metrics import Metrics
+
+
+def test_metrics_are_summed_over_the_workers(app, tmp_path, monkeypatch):
+    app.config['METRICS_DIR'] = str(tmp_path)
+    workers = []
+    for pid in (101, 102):
+        monkeypatch.setattr(os, 'getpid', lambda pid=pid: pid)
+        worker = Metrics()
+        worker.init_app(app)
+        worker.inc('cache_requests_total', 2, cache='view', result='hit')
+        worker.observe('request_seconds', 0.002, endpoint='recipes')
+        worker.flush()
+        workers.append(worker)
+
+    text = workers[0].render()
+
+    assert 'smilecook_cache_requests_total{cache="view",result="hit"} 4' \
+        in text
+    assert 'smilecook_request_seconds_count{endpoint="recipes"} 2' in text
+    assert 'smilecook_request_seconds_bucket{endpoint="recipes",le="0.005"}' \
+        ' 2' in text
+
+
+def test_metrics_of_a_single_process(app):
+    worker = Metrics()
+    worker.inc('cache_requests_total', cache='view', result='miss')
+
+    assert 'smilecook_cache_requests_total{cache="view",result="miss"} 1' \
+        in worker.render()
@@ -0,0 +1,35 @@
+from flask_jwt_extended import create_access_token
+
+from tests.queries import assert_max_queries
+
+
+def test_recipe_list_page_does_not_load_each_author(client, make_user,
+                                                    make_recipes):
+    for username in ('alice', 'bob'):
+        make_recipes(make_user(username), 25)
+
+    # the page and the count
+    with assert_max_queries(2):
+        response = client.get('/recipes?per_page=50')
+
+    assert response.status_code == 200
+    assert len(response.get_json()['data']) == 50
+
+
+def test_user_recipe_list_does_not_count_the_recipes(client, make_user,
+                                                     make_recipes):
+    user = make_user('alice')
+    make_recipes(user, 30)
+    make_recipes(user, 20, is_publish=False)
+    headers = {'Authorization': 'Bearer {}'.format(
+        create_access_token(identity=user.id))}
+
+    # the revocation check of the token, the user and the page, the total
+    # comes from the counters of the user
+    with assert_max_queries(3):
+        response = client.get('/users/alice/recipes?visibility=all'
+                              '&per_page=50', headers=headers)
+
+    assert response.status_code == 200
+    assert len(response.get_json()['data']) == 50
+    assert response.get_json()['total'] == 50
@@ -0,0 +1,39 @@
+from flask_jwt_extended import JWTManager, create_access_token
+
+from extensions import limiter, revoked_tokens
+
+
+def test_token_is_verified_once_per_request(app, client, make_user,
+                                            monkeypatch):
+    user = make_user('alice')
+    headers = {'Authorization': 'Bearer {}'.format(
+        create_access_token(identity=user.id))}
+    app.config.update(RATELIMIT_ENABLED=True, RATELIMIT_WHITELIST=[])
+    limiter.init_app(app)
+    app.config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite://'}
+
+    calls = []
+
+    def spy(name, func):
+        def wrapper(*args, **kwargs):
+            calls.append(name)
+            return func(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(JWTManager, '_decode_jwt_from_config',
+                        spy('decode', JWTManager._decode_jwt_from_config))
+    monkeypatch.setattr(revoked_tokens, 'is_revoked',
+                        spy('revoked', revoked_tokens.is_revoked))
+
+    # the key and the limit of the limiter, then the replica routing
+    response = client.get('/recipes', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['X-RateLimit-Limit'] == '60'
+    assert calls == ['decode', 'revoked']
+
+    # and the view requiring the token
+    calls.clear()
+    response = client.get('/users/alice/recipes?visibility=all',
+                          headers=headers)
+    assert response.status_code == 200
+    assert calls == ['revoked']
@@ -0,0 +1,51 @@
+import time
+
+from flask_jwt_extended import create_access_token, decode_token
+
+import revocation
+from extensions import revoked_tokens
+from tests.queries import count_queries
+
+
+def authenticate(make_user, make_recipes):
+    user = make_user('alice')
+    recipe = make_recipes(user, 1)[0]
+    token = create_access_token(identity=user.id)
+
+    return token, '/recipes/{}'.format(recipe.id), {
+        'Authorization': 'Bearer {}'.format(token)}
+
+
+def test_repeated_request_runs_no_revocation_query(client, make_user,
+                                                   make_recipes):
+    token, url, headers = authenticate(make_user, make_recipes)
+    assert client.get(url, headers=headers).status_code == 200
+
+    # the recipe is cached and the token is known not to be revoked
+    with count_queries() as statements:
+        assert client.get(url, headers=headers).status_code == 200
+
+    assert statements == []
+
+
+def test_revocation_by_the_worker_is_seen_at_once(client, make_user,
+                                                  make_recipes):
+    token, url, headers = authenticate(make_user, make_recipes)
+    assert client.get(url, headers=headers).status_code == 200
+
+    assert client.post('/revoke', headers=headers).status_code == 200
+    assert client.get(url, headers=headers).status_code == 401
+
+
+def test_revocation_by_another_worker_is_seen_after_the_negative_ttl(
+        client, make_user, make_recipes, monkeypatch):
+    token, url, headers = authenticate(make_user, make_recipes)
+    assert client.get(url, headers=headers).status_code == 200
+
+    claims = decode_token(token)
+    revoked_tokens.backend.add(claims['jti'], claims['exp'])
+    assert client.get(url, headers=headers).status_code == 200
+
+    now = time.time() + revoked_tokens.negative_ttl + 1
+    monkeypatch.setattr(revocation.time, 'time', lambda: now)
+    assert client.get(url, headers=headers).status_code == 401
@@ -0,0 +1,153 @@
+import shutil
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from config import Config
+from extensions import cache, db
+from models.recipe import Recipe
+from models.user import User
+from routing import engine_options, sticky_key
+
+
+def make_config(tmp_path):
+    class ReplicaConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(tmp_path / 'primary.db')
+        SQLALCHEMY_BINDS = {}
+        SQLALCHEMY_REPLICA_URI = 'sqlite:///{}'.format(
+            tmp_path / 'replica.db')
+        UPLOADED_IMAGES_DEST = str(tmp_path / 'images')
+        # shared by the apps of a test like by the workers
+        CACHE_TYPE = 'FileSystemCache'
+        CACHE_DIR = str(tmp_path / 'cache')
+        RATELIMIT_ENABLED = False
+
+    return ReplicaConfig
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(make_config(tmp_path))
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def replicate(tmp_path):
+    """This function copies the primary to the replica, which then lags"""
+    db.session.remove()
+    db.engines['replica'].dispose()
+    shutil.copy(tmp_path / 'primary.db', tmp_path / 'replica.db')
+
+
+def setup_recipe(tmp_path, make_user, make_recipes):
+    user = make_user('alice')
+    user_id = user.id
+    recipe_id = make_recipes(user, 1, name='Old name')[0].id
+    replicate(tmp_path)
+
+    return user_id, recipe_id, {'Authorization': 'Bearer {}'.format(
+        create_access_token(identity=user_id))}
+
+
+def names(response):
+    return [recipe['name'] for recipe in response.get_json()['data']]
+
+
+def test_replica_is_not_used_with_a_local_cache(tmp_path):
+    class LocalCacheConfig(make_config(tmp_path)):
+        CACHE_TYPE = 'SimpleCache'
+
+    app = create_app(LocalCacheConfig)
+
+    assert 'replica' not in app.config['SQLALCHEMY_BINDS']
+
+
+def test_writer_reads_its_writes_from_the_other_workers(
+        app, client, tmp_path, make_user, make_recipes):
+    user_id, recipe_id, headers = setup_recipe(tmp_path, make_user,
+                                               make_recipes)
+    url = '/users/alice/recipes?visibility=all'
+
+    response = client.patch('/recipes/{}'.format(recipe_id),
+                            json={'name': 'New name'}, headers=headers)
+    assert response.status_code == 200
+
+    other_worker = create_app(make_config(tmp_path))
+    with other_worker.app_context():
+        other_client = other_worker.test_client()
+        assert names(other_client.get(url, headers=headers)) == ['New name']
+        # the others still read from the replica
+        assert names(other_client.get(url)) == ['Old name']
+
+
+def test_values_cached_after_a_write_are_computed_on_the_primary(
+        app, client, tmp_path, make_user, make_recipes):
+    user_id, recipe_id, headers = setup_recipe(tmp_path, make_user,
+                                               make_recipes)
+    url = '/recipes/{}'.format(recipe_id)
+
+    response = client.patch(url, json={'name': 'New name'}, headers=headers)
+    assert response.status_code == 200
+    # alice reads from the replica like the others
+    cache.delete(sticky_key(user_id))
+
+    assert names(client.get('/recipes')) == ['New name']
+    assert client.get(url, headers=headers).get_json()['name'] == 'New name'
+    assert names(client.get('/users/alice/recipes')) == ['Old name']
+
+
+def test_cached_users_are_read_from_the_primary(
+        app, client, tmp_path, make_user, make_recipes):
+    user_id, recipe_id, headers = setup_recipe(tmp_path, make_user,
+                                               make_recipes)
+    make_recipes(User.get_by_id(user_id), 1)
+    make_user('bob')
+
+    # the replica has neither the recipe nor bob yet
+    response = client.get('/users/alice')
+    assert response.get_json()['published_recipe_count'] == 2
+    assert client.get('/users/bob').status_code == 200
+
+    response = client.get('/users/alice/recipes?visibility=all',
+                          headers=headers)
+    assert response.get_json()['total'] == 2
+
+
+def test_values_are_cached_from_the_replica(app, client, tmp_path,
+                                           make_user, make_recipes):
+    user_id, recipe_id, headers = setup_recipe(tmp_path, make_user,
+                                               make_recipes)
+    # a change the replica does not have, whose tags are not invalidated
+    Recipe.query.filter_by(id=recipe_id).update({'name': 'New name'})
+    db.session.commit()
+
+    assert names(client.get('/recipes')) == ['Old name']
+
+
+def test_tags_found_once_computed_are_checked(app, client, tmp_path,
+                                              make_user, make_recipes):
+    user_id, recipe_id, headers = setup_recipe(tmp_path, make_user,
+                                               make_recipes)
+    # only the recipe and the cook_time order are invalidated
+    response = client.patch('/recipes/{}'.format(recipe_id),
+                            json={'cook_time': 99}, headers=headers)
+    assert response.status_code == 200
+
+    response = client.get('/recipes?sort=created_at')
+    assert [recipe['cook_time'] for recipe in response.get_json()['data']] \
+        == [99]
+
+
+def test_pool_holds_a_connection_per_thread(monkeypatch):
+    monkeypatch.setenv('GUNICORN_THREADS', '8')
+
+    options = engine_options('postgresql://localhost/smilecook', {})
+
+    assert options['pool_size'] == 8
+    assert engine_options('postgresql://localhost/smilecook', {
+        'DATABASE_POOL_SIZE': 2})['pool_size'] == 2
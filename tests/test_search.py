@@ -0,0 +1,37 @@
+import pytest
+
+from models.recipe_search import prefix_end
+
+
+def search(client, q, sort='created_at'):
+    response = client.get('/recipes', query_string={
+        'q': q, 'sort': sort, 'order': 'asc', 'per_page': 20})
+    assert response.status_code == 200
+    return [recipe['name'] for recipe in response.get_json()['data']]
+
+
+@pytest.fixture
+def recipes(make_user, make_recipes):
+    user = make_user('alice')
+    for name in ('Chicken curry', 'Beef curry', 'Chicken soup'):
+        make_recipes(user, 1, name=name, description='A dish',
+                     ingredients='salt')
+
+
+def test_search_matches_every_term(client, recipes):
+    assert search(client, 'chicken curry') == ['Chicken curry']
+    assert search(client, 'curry chicken', sort='relevance') == \
+        ['Chicken curry']
+    assert search(client, 'chicken lamb') == []
+
+
+def test_search_matches_the_prefix_of_the_terms(client, recipes):
+    assert search(client, 'chick') == ['Chicken curry', 'Chicken soup']
+    assert search(client, 'chick cur') == ['Chicken curry']
+    assert search(client, 'curries') == []
+
+
+@pytest.mark.parametrize('prefix, end', [
+    ('chick', 'chicl'), ('abz', 'ac'), ('a9', 'aa'), ('zz', None)])
+def test_prefix_end_follows_the_terms_of_the_prefix(prefix, end):
+    assert prefix_end(prefix) == end
@@ -0,0 +1,28 @@
+from extensions import cache, password_hasher
+from models.user import User
+
+
+def login(client, password='password'):
+    return client.post('/token', json={'email': 'alice@example.com',
+                                       'password': password})
+
+
+def test_cached_user_holds_no_password(client, make_user):
+    user_id = make_user('alice').id
+    assert User.get_by_email('alice@example.com') is not None
+
+    assert 'password' not in cache.get('user:id:{}'.format(user_id))
+    assert login(client, 'wrong').status_code == 401
+    assert login(client).status_code == 200
+
+
+def test_outdated_hash_is_replaced_on_login(client, make_user,
+                                            monkeypatch):
+    user_id = make_user('alice').id
+    monkeypatch.setattr(password_hasher, 'rounds', 2000)
+    assert User.get_by_email('alice@example.com') is not None
+
+    assert login(client).status_code == 200
+    # pbkdf2 hashes read $pbkdf2-sha256$<rounds>$...
+    assert User.get_password(user_id).split('$')[2] == '2000'
+    assert login(client).status_code == 200
@@ -0,0 +1,47 @@
+from flask_jwt_extended import JWTManager, create_access_token
+
+from extensions import jwt
+from tests.queries import count_queries
+
+
+def test_repeated_request_neither_decodes_nor_queries(
+        client, make_user, make_recipes, monkeypatch):
+    user = make_user('alice')
+    url = '/recipes/{}'.format(make_recipes(user, 1)[0].id)
+    headers = {'Authorization': 'Bearer {}'.format(
+        create_access_token(identity=user.id))}
+    assert client.get(url, headers=headers).status_code == 200
+
+    decoded = []
+    decode = JWTManager._decode_jwt_from_config
+
+    def spy(*args, **kwargs):
+        decoded.append(args)
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(JWTManager, '_decode_jwt_from_config', spy)
+    with count_queries() as statements:
+        assert client.get(url, headers=headers).status_code == 200
+
+    assert decoded == []
+    assert statements == []
+
+
+def test_cache_is_off_when_the_decode_method_changed(app, client, make_user,
+                                                     monkeypatch):
+    decode = JWTManager._decode_jwt_from_config
+
+    def changed(self, encoded_token, csrf_value=None, allow_expired=False,
+                leeway=None):
+        return decode(self, encoded_token, csrf_value, allow_expired)
+
+    monkeypatch.setattr(JWTManager, '_decode_jwt_from_config', changed)
+    jwt.init_app(app)
+    assert jwt.verified_tokens.size == 0
+
+    user = make_user('alice')
+    headers = {'Authorization': 'Bearer {}'.format(
+        create_access_token(identity=user.id))}
+    response = client.get('/users/alice', headers=headers)
+    assert response.status_code == 200
+    assert 'email' in response.get_json()
@@ -0,0 +1,156 @@
+import hashlib
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context
+from flask_jwt_extended import JWTManager
+
+logger = logging.getLogger(__name__)
+
+# flask_jwt_extended has no public hook to skip the decoding of a token, so
+# the cache overrides this private method of JWTManager (as of 4.4). It is
+# turned off when an upgrade changes the method rather than breaking the
+# authentication.
+DECODE_METHOD = '_decode_jwt_from_config'
+DECODE_PARAMETERS = ['self', 'encoded_token', 'csrf_value', 'allow_expired']
+
+
+def decode_method_supported():
+    method = getattr(JWTManager, DECODE_METHOD, None)
+    if method is None:
+        return False
+
+    return list(inspect.signature(method).parameters) == DECODE_PARAMETERS
+
+
+class VerifiedTokenCache:
+    """
+    This class remembers the claims of the tokens whose signature was
+    verified, keyed by a digest of the token, in a bounded LRU. An entry
+    expires along with the exp claim of its token, and the entries of a jti
+    can be dropped at once when the token is revoked.
+    """
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.lock = threading.Lock()
+        self.tokens = OrderedDict()
+        self.digests = {}
+
+    def get(self, digest):
+        with self.lock:
+            entry = self.tokens.get(digest)
+            if entry is None:
+                return None
+            claims, jti, expires = entry
+            if expires is not None and expires <= time.time():
+                self.drop(digest)
+                return None
+            self.tokens.move_to_end(digest)
+            return claims
+
+    def add(self, digest, claims):
+        jti = claims.get('jti')
+        with self.lock:
+            self.tokens[digest] = (claims, jti, claims.get('exp'))
+            self.tokens.move_to_end(digest)
+            if jti is not None:
+                self.digests.setdefault(jti, set()).add(digest)
+            while len(self.tokens) > self.size:
+                self.drop(next(iter(self.tokens)))
+
+    def drop(self, digest):
+        # the lock is held by the caller
+        _, jti, _ = self.tokens.pop(digest)
+        digests = self.digests.get(jti)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self.digests[jti]
+
+    def evict(self, jti):
+        with self.lock:
+            for digest in list(self.digests.get(jti, ())):
+                self.drop(digest)
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
+            self.digests.clear()
+
+
+class CachingJWTManager(JWTManager):
+    """
+    This class skips decoding and verifying the signature of a token that
+    was already verified by the worker, the claims are taken from a
+    VerifiedTokenCache of JWT_VERIFIED_CACHE_SIZE entries (10000, 0 disables
+    it). The blocklist loader is still called for every request, so a
+    revoked token keeps being rejected, and RevokeResource evicts the token
+    with forget_token. The loader answers from the RevocationStore for
+    TOKEN_REVOCATION_NEGATIVE_TTL (10) seconds once a token was found not
+    revoked, so a client sending its token again costs two dict lookups, no
+    signature check and no query, while a revocation done by another worker
+    is seen within those 10 seconds.
+
+    The claims are also kept in g, so the limiter and the view verifying the
+    token of the same request decode it once.
+
+    The cache hits and misses are recorded in metrics. It relies on a
+    private method of JWTManager and is off when that method is not the one
+    it was written for, see DECODE_PARAMETERS.
+    """
+
+    def __init__(self, metrics, app=None, **kwargs):
+        self.metrics = metrics
+        self.verified_tokens = VerifiedTokenCache()
+        super().__init__(app, **kwargs)
+
+    def init_app(self, app, **kwargs):
+        super().init_app(app, **kwargs)
+        self.verified_tokens.size = app.config.get('JWT_VERIFIED_CACHE_SIZE',
+                                                   10000)
+        if self.verified_tokens.size and not decode_method_supported():
+            logger.warning('JWTManager.%s changed, the verified tokens are '
+                           'not cached', DECODE_METHOD)
+            self.verified_tokens.size = 0
+        # the tokens verified with the keys of another app are dropped
+        self.verified_tokens.clear()
+
+    def _decode_jwt_from_config(self, *args, **kwargs):
+        if not self.verified_tokens.size:
+            return super()._decode_jwt_from_config(*args, **kwargs)
+
+        return self.decode_cached(*args, **kwargs)
+
+    def decode_cached(self, encoded_token, csrf_value=None,
+                      allow_expired=False):
+        if allow_expired:
+            return super()._decode_jwt_from_config(
+                encoded_token, csrf_value, allow_expired)
+
+        # the csrf value is part of the key since it is checked on decoding
+        digest = hashlib.sha256('{}:{}'.format(
+            encoded_token, csrf_value).encode()).digest()
+        if has_request_context() and digest in g.get('jwt_verified', {}):
+            return dict(g.jwt_verified[digest])
+
+        claims = self.verified_tokens.get(digest)
+        if claims is not None:
+            self.metrics.inc('cache_requests_total', cache='jwt', result='hit')
+        else:
+            self.metrics.inc('cache_requests_total', cache='jwt',
+                             result='miss')
+            claims = super()._decode_jwt_from_config(encoded_token, csrf_value)
+            self.verified_tokens.add(digest, dict(claims))
+
+        if has_request_context():
+            g.setdefault('jwt_verified', {})[digest] = dict(claims)
+
+        return dict(claims)
+
+    def forget_token(self, jti):
+        """This method drops the verified claims of the tokens of a jti"""
+        self.verified_tokens.evict(jti)
@@ -1,20 +1,59 @@
 from pickletools import optimize
+from urllib.parse import urlencode
+import gzip
+import hashlib
+import threading
+import time
 import uuid
 import os
+import re
+import weakref
 
-from passlib.hash import pbkdf2_sha256
 from itsdangerous import URLSafeTimedSerializer
-from flask import current_app
+from flask import (
+    Response, copy_current_request_context, current_app, g, request, url_for)
+from flask_restful.representations.json import output_json
 from flask_uploads import extension
-from extensions import image_set, cache
+from extensions import (
+    image_set, image_pool, cache, password_hasher, metrics)
 from PIL import Image
+from routing import fresh_reads, primary, recently_invalidated, \
+    remember_invalidation
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the longest side in pixels of each size an uploaded image is stored in
+IMAGE_SIZES = {'thumbnail': 320, 'medium': 800, 'full': 1600}
+# the largest image accepted, in pixels, unless IMAGE_MAX_PIXELS is set
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a',
+                    b'GIF89a', b'BM')
+# the static filenames that url_for leaves as they are
+STATIC_SAFE_FILENAME = re.compile(r'^[A-Za-z0-9._/-]+$')
+# the folders of the uploaded images, served by ImageResource
+IMAGE_FOLDERS = ('covers', 'avatars')
+# the processed images are named after their content, so their files never
+# change and can be cached forever.
+HASHED_IMAGE_NAME = re.compile(r'^[0-9a-f]{32}_[a-z]+\.(jpg|webp)$')
+# the tag whose version changes whenever any tag is invalidated
+ANY_TAG = '*'
 
 
 def hash_password(password):
-    return pbkdf2_sha256.hash(password)
+    return password_hasher.hash(password)
 
 def verify_password(password, hashed):
-    return pbkdf2_sha256.verify(password, hashed)
+    return password_hasher.verify(password, hashed)
+
+def verify_and_update_password(password, hashed):
+    """
+    This function returns whether the password is valid, along with a new
+    hash to store when the hashing parameters changed since it was hashed.
+    """
+    return password_hasher.verify_and_update(password, hashed)
 
 def generate_token(email, salt=None):
     serializer = URLSafeTimedSerializer(current_app.config.get('SECRET_KEY'))
@@ -31,41 +70,559 @@ def verify_token(token,max_age=(30*60*60), salt=None):
     
     return email
 
+def check_image(image):
+    """
+    This function checks an upload before it is stored, only the first bytes
+    and the header of the image are read so that oversized images and
+    decompression bombs are rejected without being decoded. It returns an
+    error message, or None when the image is valid.
+    """
+    stream = image.stream
+    header = stream.read(16)
+    stream.seek(0)
+    
+    if not any(header.startswith(signature) for signature in
+               IMAGE_SIGNATURES) and not (header[:4] == b'RIFF' and
+                                          header[8:12] == b'WEBP'):
+        return "Not a valid image"
+    
+    try:
+        # Image.open only parses the header, the pixels are not decoded
+        with Image.open(stream) as header_image:
+            width, height = header_image.size
+    except Image.DecompressionBombError:
+        return "Image is too large"
+    except Exception:
+        return "Not a valid image"
+    finally:
+        stream.seek(0)
+    
+    if width * height > current_app.config.get('IMAGE_MAX_PIXELS',
+                                               IMAGE_MAX_PIXELS):
+        return "Image is too large"
+    
+    return None
+
 def save_image(image, folder):
+    """
+    This function stores an upload as it is, the file can be served right
+    away while process_image compresses it.
+    """
     filename = '{}.{}'.format(uuid.uuid4(), extension(image.filename))
     image_set.save(image, folder=folder, name=filename)
     
-    filename = compress_image(filename, folder)
-    
     return filename
 
-def compress_image(filename, folder):
+def process_image(filename, folder, on_done, force=False):
+    """
+    This function compresses an uploaded image in the image pool and returns
+    at once. When the compressed variants are ready on_done(filename) is
+    called in an app context from a background thread with the filename of
+    the full size variant. force is passed to compress_image.
+    """
+    app = current_app._get_current_object()
     file_path = image_set.path(folder=folder, filename=filename)
+    webp = app.config.get('IMAGE_WEBP', False)
+    
+    def done(future):
+        try:
+            compressed_filename = future.result()
+        except FileNotFoundError:
+            # the upload was replaced by another one before it was processed
+            return
+        except Exception:
+            app.logger.exception('Could not compress %s', file_path)
+            return
+        
+        with app.app_context():
+            on_done(compressed_filename)
+    
+    max_pixels = app.config.get('IMAGE_MAX_PIXELS', IMAGE_MAX_PIXELS)
+    
+    image_pool.submit(compress_image, file_path, webp, max_pixels, force) \
+        .add_done_callback(done)
+
+def swap_image(instance, attribute, folder, filename, compressed_filename,
+               in_use=None, on_done=None):
+    """
+    This function points the attribute of instance to the compressed image
+    if it still holds the uploaded one, i.e. no other upload replaced it in
+    the meantime, and removes the files that are no longer used (see
+    remove_image for in_use). It returns True when the image was swapped.
+    
+    The files were already there when the upload has the content of another
+    image, and they are removed when that image is dropped until a row
+    refers to them. When they are missing they are written again by
+    process_image, which then calls on_done (the caller of swap_image) again
+    and the upload is kept until then.
+    """
+    current = getattr(instance, attribute) if instance is not None else None
+    webp = current_app.config.get('IMAGE_WEBP', False)
+    
+    if current == filename:
+        if image_missing(folder, compressed_filename, webp) and on_done:
+            process_image(filename, folder, on_done, force=True)
+            return False
+        
+        setattr(instance, attribute, compressed_filename)
+        instance.save()
+        # they may be removed until the row was committed
+        if image_missing(folder, compressed_filename, webp) and on_done:
+            process_image(filename, folder, on_done, force=True)
+        else:
+            remove_image(folder, filename)
+        return True
+    
+    if current == compressed_filename:
+        # swapped before its files were written again
+        remove_image(folder, filename)
+    else:
+        remove_image(folder, compressed_filename, in_use)
+    
+    return False
+
+def image_variants(filename, webp=False):
+    """
+    This function returns the filename of each size of an image. Images that
+    were not processed into variants, i.e. legacy or pending uploads, use
+    the same file for every size and have no WebP variant.
+    """
+    if not filename.endswith('_full.jpg'):
+        return {size: filename for size in IMAGE_SIZES}, {}
+    
+    base = filename[:-len('_full.jpg')]
+    variants = {size: '{}_{}.jpg'.format(base, size) for size in IMAGE_SIZES}
+    webp_variants = {size: '{}_{}.webp'.format(base, size)
+                     for size in IMAGE_SIZES} if webp else {}
+    
+    return variants, webp_variants
+
+def image_srcset(folder, filename):
+    """
+    This function returns the url of each size of an image, the WebP urls
+    are listed under 'webp' when IMAGE_WEBP is set. IMAGE_WEBP has to be set
+    before the images are uploaded since it also decides whether the WebP
+    variants are written.
+    """
+    variants, webp_variants = image_variants(
+        filename, webp=current_app.config.get('IMAGE_WEBP', False))
+    
+    srcset = {size: image_url(folder, name)
+              for size, name in variants.items()}
+    if webp_variants:
+        srcset['webp'] = {size: image_url(folder, name)
+                          for size, name in webp_variants.items()}
+    
+    return srcset
+
+def static_url(filename):
+    """
+    This function returns the same url as url_for('static', filename=...,
+    _external=True). The url of the static folder is built once per request
+    and kept in g, since the lists build several image urls for each item.
+    """
+    if not STATIC_SAFE_FILENAME.match(filename):
+        return url_for('static', filename=filename, _external=True)
+    
+    prefix = g.get('static_url_prefix')
+    if prefix is None:
+        prefix = url_for('static', filename='_', _external=True)[:-1]
+        g.static_url_prefix = prefix
+    
+    return prefix + filename
+
+def image_url(folder, filename):
+    """
+    This function returns the url of an image. The uploaded images are
+    served by ImageResource, the other ones (the default images) from the
+    static folder. Like static_url, the url of each folder is built once per
+    request.
+    """
+    if folder not in IMAGE_FOLDERS:
+        return static_url('images/{}/{}'.format(folder, filename))
+    if not STATIC_SAFE_FILENAME.match(filename):
+        return url_for('imageresource', folder=folder, filename=filename,
+                       _external=True)
+    
+    prefixes = g.setdefault('image_url_prefixes', {})
+    prefix = prefixes.get(folder)
+    if prefix is None:
+        prefix = url_for('imageresource', folder=folder, filename='_',
+                         _external=True)[:-1]
+        prefixes[folder] = prefix
+    
+    return prefix + filename
+
+def image_missing(folder, filename, webp=False):
+    """This function tells if a file of an image or of a variant is missing"""
+    variants, webp_variants = image_variants(filename, webp)
+    
+    return not all(
+        os.path.exists(image_set.path(folder=folder, filename=name))
+        for name in {filename, *variants.values(), *webp_variants.values()})
+
+def remove_image(folder, filename, in_use=None):
+    """
+    This function removes an image along with its variants. Since the
+    processed images are named after their content, the same files can be
+    used by several rows, in_use(filename) tells whether they still are.
+    """
+    if in_use is not None and in_use(filename):
+        return
+    
+    variants, webp_variants = image_variants(filename, webp=True)
+    
+    for name in {filename, *variants.values(), *webp_variants.values()}:
+        path = image_set.path(folder=folder, filename=name)
+        if os.path.exists(path):
+            os.remove(path)
+
+def image_hash(file_path):
+    """
+    This function returns the name the variants of an image are stored
+    under: a hash of the image and of the sizes it is compressed to, so that
+    changing the sizes gives new names.
+    """
+    digest = hashlib.sha256(repr(sorted(IMAGE_SIZES.items())).encode())
+    with open(file_path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(64 * 1024), b''):
+            digest.update(chunk)
+    
+    return digest.hexdigest()[:32]
+
+def save_variant(image, path, image_format, **options):
+    """
+    This function writes an image under a temporary name first, a variant is
+    cached forever under its name so it must never be served half written.
+    """
+    temporary_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    image.save(temporary_path, image_format, **options)
+    os.replace(temporary_path, path)
+
+def compress_image(file_path, webp=False, max_pixels=None, force=False):
+    """
+    This function runs in the image pool. It writes a JPEG of each size in
+    IMAGE_SIZES (and a WebP one when webp is True) next to the image and
+    returns the filename of the full size one. The files are named after a
+    hash of the image and of the sizes, so the same upload is only processed
+    once and a name always holds the same content, unless force is True.
+    """
+    folder = os.path.dirname(file_path)
+    base = image_hash(file_path)
+    compressed_filename = '{}_full.jpg'.format(base)
+    # the smallest size is written last, so once it is there the image was
+    # already processed.
+    last = os.path.join(folder, '{}_{}.{}'.format(
+        base, min(IMAGE_SIZES, key=IMAGE_SIZES.get), 'webp' if webp else 'jpg'))
+    if os.path.exists(last) and not force:
+        return compressed_filename
+    
+    Image.MAX_IMAGE_PIXELS = max_pixels or IMAGE_MAX_PIXELS
     image = Image.open(file_path)
+    # JPEGs are decoded straight at a reduced scale when they are larger
+    # than needed, which bounds the memory used whatever their resolution.
+    max_side = max(IMAGE_SIZES.values())
+    image.draft('RGB', (max_side, max_side))
     
     if image.mode != "RGB":
         image = image.convert("RGB")
-    if max(image.width, image.height) > 1600:
-        max_size = (1600, 1600)
-        image.thumbnail(max_size, Image.ANTIALIAS)
-    
-    compressed_filename = '{}.jpg'.format(uuid.uuid4())
-    compressed_filename_path = image_set.path(
-        filename=compressed_filename, folder=folder
-    )
-    image.save(compressed_filename_path, optimize=True, quality=85)
-    original_size = os.stat(file_path).st_size
-    compressed_size = os.stat(compressed_filename_path).st_size
-    percentage = round((original_size - compressed_size)/original_size * 100)
-    print("The file size is reduced by {}%, from {} to {}".format(
-        percentage, original_size, compressed_size
-    ))
-    
-    os.remove(file_path)
+    
+    # the sizes are made from the largest to the smallest, each one being
+    # scaled down from the previous one.
+    for size, max_side in sorted(IMAGE_SIZES.items(),
+                                 key=lambda item: -item[1]):
+        if max(image.width, image.height) > max_side:
+            image.thumbnail((max_side, max_side), Image.ANTIALIAS)
+        
+        name = os.path.join(folder, '{}_{}'.format(base, size))
+        save_variant(image, name + '.jpg', 'JPEG', optimize=True, quality=85)
+        if webp:
+            save_variant(image, name + '.webp', 'WEBP', quality=80)
     
     return compressed_filename
 
-def clear_cache(key_prefix):
-    keys = [key for key in cache.cache._cache.keys() if key.
-            startswith(key_prefix)]
-    cache.delete_many(*keys)
\ No newline at end of file
+def request_cache_key():
+    """
+    This function builds a cache key from the path and the query string of
+    the current request, the arguments are sorted so that the same query
+    always gives the same key.
+    """
+    query_string = urlencode(sorted(request.args.items(multi=True)))
+    digest = hashlib.md5(query_string.encode()).hexdigest()
+
+    return 'view:{}:{}'.format(request.path, digest)
+
+def get_tag_versions(tags):
+    keys = ['tag:{}'.format(tag) for tag in tags]
+
+    return dict(zip(tags, cache.get_many(*keys)))
+
+def snapshot_tags(tags=()):
+    """
+    This function returns the current version of each of the tags, along
+    with the version of ANY_TAG, which changes on every invalidation. A tag
+    that has no version yet is given a random one, random versions ensure
+    that a tag evicted from the cache never matches again.
+    """
+    tags = list(set(tags) | {ANY_TAG})
+    versions = get_tag_versions(tags)
+    missing = [tag for tag, version in versions.items() if version is None]
+    for tag in missing:
+        cache.add('tag:{}'.format(tag), uuid.uuid4().hex, timeout=0)
+    if missing:
+        versions = get_tag_versions(tags)
+
+    return versions
+
+def lookup_tagged(key, record=True):
+    """
+    This function returns a value stored with set_tagged along with its
+    state: 'hit', 'expired' when it is past its soft timeout but can still
+    be served, 'stale' when one of its tags was invalidated since it was
+    stored or 'miss'. The value is None unless it is a hit or expired.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        value, state = None, 'miss'
+    else:
+        # the entries stored before the soft timeouts have no refresh time
+        value, versions = entry[:2]
+        refresh_at = entry[2] if len(entry) > 2 else None
+        if versions and get_tag_versions(list(versions)) != versions:
+            value, state = None, 'stale'
+        elif refresh_at is not None and time.time() >= refresh_at:
+            state = 'expired'
+        else:
+            state = 'hit'
+
+    if record:
+        metrics.inc('cache_requests_total', cache=key.split(':', 1)[0],
+                    result=state)
+    return value, state
+
+def get_tagged(key):
+    """
+    This function returns a value stored with set_tagged, or None when it is
+    missing or when one of its tags was invalidated since it was stored.
+    """
+    return lookup_tagged(key)[0]
+
+def set_tagged(key, value, tags, timeout=None, stale_timeout=0,
+               snapshot=None):
+    """
+    This function stores a value along with the version of each of its tags
+    and returns whether it was stored. snapshot is what snapshot_tags
+    returned before the value was computed, the tags are stored with the
+    versions they had then so that an invalidation done while the value was
+    computed is not lost. The tags that were not in the snapshot can only be
+    checked as a whole, the value is not stored when any tag was invalidated
+    in between. The value is kept stale_timeout seconds past its timeout so
+    that get_or_compute can serve it while it is refreshed.
+    """
+    tags = set(tags)
+    if snapshot is None:
+        snapshot = snapshot_tags(tags)
+    versions = {tag: snapshot[tag] for tag in tags if tag in snapshot}
+    late_tags = tags - set(snapshot)
+    if late_tags:
+        current = snapshot_tags(late_tags)
+        if current[ANY_TAG] != snapshot[ANY_TAG]:
+            return False
+        versions.update((tag, current[tag]) for tag in late_tags)
+
+    if timeout:
+        cache.set(key, (value, versions, time.time() + timeout),
+                  timeout=timeout + stale_timeout)
+    else:
+        cache.set(key, (value, versions, None), timeout=timeout)
+
+    return True
+
+class KeyLock:
+    """
+    This class holds the lock of a key in the current process, it is a
+    class so that the locks that are not used anymore can be dropped.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+
+# the locks of the keys being computed by the threads of this process
+_key_locks = weakref.WeakValueDictionary()
+_key_locks_lock = threading.Lock()
+
+def get_key_lock(key):
+    with _key_locks_lock:
+        key_lock = _key_locks.get(key)
+        if key_lock is None:
+            key_lock = _key_locks[key] = KeyLock()
+
+    return key_lock
+
+def acquire_shared_lock(key):
+    """
+    This function takes the lock of a key shared by the workers through the
+    cache and returns its token, or None when another worker holds it. The
+    lock expires after CACHE_LOCK_TIMEOUT seconds in case its holder dies.
+    """
+    token = uuid.uuid4().hex
+    if cache.add('lock:{}'.format(key), token, timeout=current_app.config.get(
+            'CACHE_LOCK_TIMEOUT', 10)):
+        return token
+
+    return None
+
+def release_shared_lock(key, token):
+    # the lock is only dropped if it did not expire and was taken by another
+    if cache.get('lock:{}'.format(key)) == token:
+        cache.delete('lock:{}'.format(key))
+
+def compute_fresh(compute, tags):
+    """
+    This function calls compute, on the replica for the read only requests
+    unless one of the tags of the value was invalidated lately (see
+    fresh_reads). The tags that are only known once it is computed are
+    checked after, and the value is computed again on the primary if one of
+    them was.
+    """
+    with fresh_reads(tags):
+        value, value_tags = compute()
+    
+    if recently_invalidated(set(value_tags) - set(tags)):
+        with primary():
+            value, value_tags = compute()
+    
+    return value, value_tags
+
+def refresh_in_background(key, compute, tags, timeout, stale_timeout,
+                          key_lock, token):
+    """
+    This function computes a value again in a thread with a copy of the
+    current request and releases the locks of its key once it is stored.
+    """
+    app = current_app._get_current_object()
+    # g is not copied along with the request
+    read_only = g.get('read_only')
+
+    @copy_current_request_context
+    def refresh():
+        g.read_only = read_only
+        try:
+            snapshot = snapshot_tags(tags)
+            value, value_tags = compute_fresh(compute, tags)
+            set_tagged(key, value, value_tags, timeout, stale_timeout,
+                       snapshot)
+        except Exception:
+            app.logger.exception('Could not refresh %s', key)
+        finally:
+            release_shared_lock(key, token)
+            key_lock.lock.release()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+def get_or_compute(key, compute, timeout, stale_timeout=None, tags=()):
+    """
+    This function returns the value cached under key, computing it with
+    compute, which returns the value and its tags, when it is missing. tags
+    are the tags of the value known before it is computed, see set_tagged.
+    Only one caller computes a key at a time, the threads of a worker wait
+    on a lock and the workers share a lock in the cache. An expired value is
+    served for stale_timeout more seconds while a single caller refreshes it
+    in the background, a value whose tags were invalidated is not served.
+    The value is computed as in compute_fresh.
+    """
+    if stale_timeout is None:
+        stale_timeout = current_app.config.get('CACHE_STALE_TIMEOUT', 30)
+
+    value, state = lookup_tagged(key)
+    if state == 'hit':
+        return value
+
+    key_lock = get_key_lock(key)
+    if state == 'expired':
+        if key_lock.lock.acquire(blocking=False):
+            token = acquire_shared_lock(key)
+            if token is not None:
+                refresh_in_background(key, compute, tags, timeout,
+                                      stale_timeout, key_lock, token)
+            else:
+                key_lock.lock.release()
+        return value
+
+    with key_lock.lock:
+        # another thread may have stored it while this one waited
+        value, state = lookup_tagged(key, record=False)
+        if state in ('hit', 'expired'):
+            return value
+
+        token = acquire_shared_lock(key)
+        deadline = time.time() + current_app.config.get(
+            'CACHE_LOCK_WAIT', 5)
+        while token is None and time.time() < deadline:
+            time.sleep(0.05)
+            value, state = lookup_tagged(key, record=False)
+            if state in ('hit', 'expired'):
+                return value
+            token = acquire_shared_lock(key)
+
+        # it is computed anyway when the other worker takes too long
+        try:
+            snapshot = snapshot_tags(tags)
+            value, value_tags = compute_fresh(compute, tags)
+            set_tagged(key, value, value_tags, timeout, stale_timeout,
+                       snapshot)
+        finally:
+            if token is not None:
+                release_shared_lock(key, token)
+
+    return value
+
+def invalidate_tags(*tags):
+    """
+    This function invalidates every value stored with one of the tags, only
+    the version of each tag is changed so it does not depend on the number
+    of values in the cache.
+    """
+    cache.set_many({'tag:{}'.format(tag): uuid.uuid4().hex
+                    for tag in set(tags) | {ANY_TAG}}, timeout=0)
+    remember_invalidation(tags)
+
+def encode_response(data):
+    """
+    This function encodes data the way Flask-RESTful does and compresses the
+    body with gzip, and brotli when it is installed, so that the encodings
+    can be cached and sent as they are by json_response.
+    """
+    body = output_json(data, 200).get_data()
+    encodings = {'identity': body}
+    # small bodies are not worth the headers and the work of decompressing
+    if len(body) < current_app.config.get('COMPRESS_MIN_SIZE', 500):
+        return encodings
+    
+    with metrics.timer('compress_seconds'):
+        encodings['gzip'] = gzip.compress(
+            body, current_app.config.get('COMPRESS_GZIP_LEVEL', 6), mtime=0)
+        if brotli is not None:
+            encodings['br'] = brotli.compress(
+                body, quality=current_app.config.get('COMPRESS_BR_LEVEL', 5))
+    
+    return encodings
+
+def json_response(encodings, status=200):
+    """
+    This function returns the best encoding of a body made by
+    encode_response for the Accept-Encoding of the request.
+    """
+    accept_encodings = request.accept_encodings
+    encoding = 'identity'
+    for name in ('br', 'gzip'):
+        if name in encodings and accept_encodings[name]:
+            encoding = name
+            break
+    
+    response = Response(encodings[encoding], status=status,
+                        mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    
+    return response
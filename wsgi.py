@@ -0,0 +1,10 @@
+"""
+This module is the production entry point of the app for WSGI servers:
+
+    gunicorn wsgi:app
+
+gunicorn reads its settings from gunicorn.conf.py.
+"""
+from app import create_app
+
+app = create_app()